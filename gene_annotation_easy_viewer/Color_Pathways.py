@@ -1,107 +1,176 @@
-import pickle
 import os
-import sys
-import colorsys
-import math
-import copy
-import tkinter as tk
-from collections import namedtuple
-from tkinter import filedialog, messagebox, simpledialog
-from tkinter import *
+import json
+import time
+import multiprocessing
+import concurrent.futures
+try:  # only the window needs tkinter; export_pathways() also runs without it
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, simpledialog
+    from tkinter import *
+except ImportError:
+    tk = None
 from GAEV import *
+import GAEV
 
 cur_dir = os.getcwd()
 
-sets_to_highlight = {}  # {"blue": [gene1, gene,2 gene5], "green": [gene4, gene7, gene9], ...}
+sets_to_highlight = {}  # {"blue": {gene1, gene2, gene5}, "green": {gene4, gene7, gene9}, ...}
+gene_colors = {}  # reverse index of sets_to_highlight {gene_id: (color_hex, ...)} with the color of every set of a gene
 pathway_info_full = {}
 pathway_info_query = {}
-gene_info_full = {}
+gene_info_full = {}  # {"K14515": [gene_id, gene_id, ...], ...}; only ids are kept so large data files fit in memory
 gene_info_query = {}
-color_hex_dict = {}  # will store the color hex of each k code in query {"K14515": }
+gene_ids_full = set()  # every gene id of the full annotation, to report the ids of a set that are not in it
+loaded_sets = {}  # gene sets read by export_batch() {path: set of gene ids}, shared by every configuration using them
+pathway_incidence = None  # Pathway_Incidence linking the k codes and pathways of the full annotation
+pathway_coverage = {}  # percentage of the k codes of each pathway in query that are highlighted {"map00010": 12.5, ...}
+color_hex_dict = {}  # will store the color hex of each k code in query {"K14515": "7df9ff", ...}; "bg,%23fg" in split mode
+# ways the colors of the genes of a k code can be combined, see generate_color_hex_dict()
+blend_modes = ("blend", "dominant", "split")
+# highlight colors that can be given by name instead of color hex
+color_names = {"blue": "7DF9FF", "purple": "DB70FF", "red": "FF261F", "orange": "FFAE42", "yellow": "FFF600",
+               "green": "39FF14", "pink": "FF66CC", "brown": "AF6E4D"}
 
 
 def load_full_annotation(data_file_path_full):
     # imports data from files and stores it into appropriate lists and dict for later access
-    with open(data_file_path_full, "rb") as f:  # open data file that was generated previously
-        if not pickle.load(f):  # reads the first line of saved data which tells whether it is complete or not
-            messagebox.showerror("Data is not complete")  # exits program if data is not complete
-            return
-
-        for _ in range(pickle.load(f)):  # reads line that tells program how many data entries there are in genes
-            gene = pickle.load(f)  # stores the Gene object as gene
-            if gene.k_code in gene_info_full:  # dictionary with the k code as the key and gene object stored in list
-                gene_info_full[gene.k_code].append(gene)  # adds gene to list of other genes with shared k codes in dict
-            else:
-                gene_info_full[gene.k_code] = [gene]  # adds new k code entry in dict as key with corresponding gene in list
-        for _ in range(pickle.load(f)):  # reads line that tells program how many data entries there are in pathways
-            pathway = pickle.load(f)
-            pathway_info_full[pathway.map_code] = pathway  # loads data into pathway_info_1
-
+    global pathway_incidence
+    header = read_data_header(data_file_path_full)  # open data file that was generated previously
+    if not header["completed"]:  # reads the header of saved data which tells whether it is complete or not
+        raise ValueError("Data is not complete")  # shown by the window, which cannot use the data file
+
+    # streams the Gene objects stored in the data file one block at a time without keeping them
+    for gene in read_data_genes(data_file_path_full, header):
+        gene_ids_full.add(gene.gene_num)
+        if gene.k_code in gene_info_full:  # dictionary with the k code as the key and gene ids stored in list
+            gene_info_full[gene.k_code].append(gene.gene_num)  # adds gene to list of other genes with shared k codes in dict
+        else:
+            gene_info_full[gene.k_code] = [gene.gene_num]  # adds new k code entry in dict as key with corresponding gene in list
+    pathway_info_full.update(read_data_pathway_index(data_file_path_full, header))  # loads the pathways by map code
+    pathway_incidence = Pathway_Incidence(pathway_info_full.values())  # which k codes are in which pathway
+
+
+# will simply read file and return a set with each striped line that is not blank as an element
+def load_set(set_input_path):  # the gene ID is the first column of every line, so input files of GAEV can be used too
+    return read_gene_ids(set_input_path)
+
+
+# returns a message telling how many gene ids of gene_set are not in the full annotation, or None if all of them are
+def report_unmatched(set_input_path, gene_set):
+    unmatched = sorted(gene_set - gene_ids_full)
+    if not unmatched:
+        return None
+    message = str(len(unmatched)) + " of " + str(len(gene_set)) + " gene IDs in " + os.path.basename(set_input_path) + \
+              " were not found in the annotation reference file (ex. genes without a K number): " + ", ".join(unmatched[:10]) + \
+              (", ..." if len(unmatched) > 10 else "")
+    print(message)
+    return message
+
+
+# returns the color hex of a color name in color_names (case-insensitive) or of a color hex, or None if it is neither
+def color_hex(color_text):
+    if color_text.lower() in color_names:
+        return color_names[color_text.lower()]
+    color_text = color_text.lstrip("#")
+    if len(color_text) == 6:
+        try:
+            int(color_text, 16)
+            return color_text.upper()
+        except ValueError:
+            pass
+    return None
 
-# will simply read file and return list with each striped line on an element
-def load_set(set_input_path):
-    output_list = []
-    with open(set_input_path, 'r') as f:
-        for line in f:
-            output_list.append(line.strip())  # strip to remove unexpected blank spaces / new lines
 
-    return output_list
+def generate_gene_colors():  # indexes the colors of every gene in sets_to_highlight
+    gene_colors.clear()
+    for color, gene_set in sets_to_highlight.items():
+        for gene_num in gene_set:
+            gene_colors[gene_num] = gene_colors.get(gene_num, ()) + (color,)
 
 
-def generate_gene_info_query():  # generates a deep copy of gene_info_full and only keeps genes that are in sets_to_highlight
+def generate_gene_info_query():  # keeps the genes of gene_info_full that are in sets_to_highlight, by k code
     global gene_info_query
 
-    # makes a new copy of gene_info_full that can be changed independently of the original
-    gene_info_query = copy.deepcopy(gene_info_full)
-    # removes all genes in gene_info_query that are not in the set to be highlighted, removed genes will appear as
-    # grey on the pathway
-    for k_code in gene_info_full:
-        gene_info_query[k_code] = [gene for gene in gene_info_full[k_code]
-                                   if any([gene.gene_num in gene_set for gene_set in sets_to_highlight.values()])]
-
-    # removes all k_codes form gene_info_query dict that has no genes in the set to highlight
-    gene_info_query = dict([(k_code, gene_list) for k_code, gene_list in gene_info_query.items() if gene_list])
+    generate_gene_colors()
+    # only new lists of the genes to highlight are made, gene_info_full is not copied; k codes without any are left
+    # out and their genes will appear as grey on the pathway
+    gene_info_query = {}
+    for k_code, gene_list in gene_info_full.items():
+        gene_list = [gene_num for gene_num in gene_list if gene_num in gene_colors]
+        if gene_list:
+            gene_info_query[k_code] = gene_list
 
 
 def generate_pathway_info_query():
     global pathway_info_query
 
-    # makes a new copy of pathway_info_full that can be changed independently of the original
-    pathway_info_query = copy.deepcopy(pathway_info_full)
-
-    # empties list of genes involved in pathway from every pathway in query list, so that it may be repopulated with
-    # only genes from gene_info_query
-    for map_code in pathway_info_full:
-        pathway_info_query[map_code].genes_invol = []
-
-    for k_code in gene_info_query:
-        # only have to iterate through one gene object for each k_code since genes with the same k_code will have
-        # identical  link_path
-        for map_info in gene_info_query[k_code][0].link_path:  # map info is [m-code\description, ...]
-            m_code = map_info[:8]    # isolates the map code which is always 8 characters map#####
-            # calls method to add k_code to genes_invol while keeping the k_code ordered and preventing duplicates
-            pathway_info_query[m_code].add_gene(k_code)
-
-    pathway_info_query = dict([(m_code, pathway) for m_code, pathway in pathway_info_query.items()
-                               if pathway.genes_invol and len(pathway_info_full[m_code].genes_invol) < 104])
-
-
-# will specific the color of each gene by K code, if more than one color is used then
-def generate_color_hex_dict():
-    for k_code in gene_info_query:
-        color_list = []
-        # finds highlight color associated with the gene and adds it to the color list
-        for gene in gene_info_query[k_code]:
-            for color in sets_to_highlight.keys():
-                if gene.gene_num in sets_to_highlight[color]:
-                    color_list.append(color)
-
-        # will blend all colors from all genes associated with the k_code
-        # ex. blue + red = purple; it is weighted by occurrence of color blue + 3 red = dark pink
-        blend_dict = {}  # {color_hex: weight, color_hex: weight, ...} where weight is number of occurrence
-        for color in set(color_list):
-            blend_dict[color] = color_list.count(color)
-        color_hex_dict[k_code] = combine_hex_values(blend_dict)
+    # the k codes in gene_info_query are counted in every pathway at once using the incidence of the full annotation
+    k_mask = pathway_incidence.k_mask(gene_info_query)
+    counts = pathway_incidence.pathway_counts(k_mask)
+    coverage = pathway_incidence.coverage(k_mask)
+
+    # new pathways hold only the k codes from gene_info_query; pathways without any, or too large to be drawn by
+    # KEGG, are left out
+    pathway_info_query = {}
+    pathway_coverage.clear()
+    for number, full_pathway in enumerate(pathway_incidence.pathways):
+        if counts[number] and pathway_incidence.sizes[number] < 104:
+            query_pathway = Pathway_MAP(full_pathway.map_code + " " + full_pathway.name)
+            query_pathway.genes_invol = pathway_incidence.pathway_k_codes(number, k_mask)
+            pathway_info_query[full_pathway.map_code] = query_pathway
+            pathway_coverage[full_pathway.map_code] = coverage[number]
+
+
+# will specific the color of each gene by K code, if more than one color is used then they are combined by mode:
+#   "blend" mixes the colors weighted by number of genes, ex. blue + red = purple; blue + 3 red = dark pink
+#   "dominant" uses the color of most genes; the set added first wins a tie
+#   "split" uses the color of most genes as the background and the second one as the text and border of the k code
+def generate_color_hex_dict(mode = "blend"):
+    if mode not in blend_modes:
+        raise ValueError("mode must be one of " + ", ".join(blend_modes))
+    colors = list(sets_to_highlight)  # the number of a color is its position here
+    color_numbers = {color: number for number, color in enumerate(colors)}
+    color_hex_dict.clear()  # forgets the colors of a previous export
+    k_codes = list(gene_info_query)
+    # (k code, color) pairs, once for every gene of the k code in a set of that color
+    pair_k = []
+    pair_color = []
+    for k_number, k_code in enumerate(k_codes):
+        for gene_num in gene_info_query[k_code]:
+            for color in gene_colors[gene_num]:
+                pair_k.append(k_number)
+                pair_color.append(color_numbers[color])
+
+    if k_codes and numpy is not None:  # every k code is combined at once as a k code x color count matrix
+        counts = numpy.bincount(numpy.array(pair_k, dtype=numpy.int64) * len(colors) + numpy.array(pair_color),
+                                minlength=len(k_codes) * len(colors)).reshape(len(k_codes), len(colors))
+        rgb = numpy.array([[int(color[i:i + 2], 16) for i in (0, 2, 4)] for color in colors], dtype=numpy.int64)
+        if mode == "blend":  # the weighted average is truncated like combine_hex_values()
+            combined = [counts @ rgb // counts.sum(axis=1, keepdims=True)]
+        else:
+            order = numpy.argsort(-counts, axis=1, kind="stable")  # colors by number of genes; ties keep the set order
+            combined = [rgb[order[:, 0]]]
+            if mode == "split" and len(colors) > 1:  # k codes of a single color keep only that color
+                combined.append(numpy.where((counts[numpy.arange(len(k_codes)), order[:, 1]] > 0)[:, None],
+                                            rgb[order[:, 1]], -1))
+        for k_number, k_code in enumerate(k_codes):
+            color_hex_dict[k_code] = ",%23".join(["%02x%02x%02x" % tuple(part[k_number]) for part in combined
+                                                  if part[k_number][0] >= 0])
+    else:  # without numpy each k code is combined on its own, with the same result
+        counts = [[0] * len(colors) for k_code in k_codes]
+        for k_number, color_number in zip(pair_k, pair_color):
+            counts[k_number][color_number] += 1
+        for k_number, k_code in enumerate(k_codes):
+            if mode == "blend":
+                # {color_hex: weight, color_hex: weight, ...} where weight is number of occurrence
+                blend_dict = {colors[number]: count for number, count in enumerate(counts[k_number]) if count}
+                color_hex_dict[k_code] = combine_hex_values(blend_dict)
+                continue
+            order = sorted(range(len(colors)), key=lambda number: -counts[k_number][number])  # stable, like above
+            combined = order[:1]
+            if mode == "split" and len(colors) > 1 and counts[k_number][order[1]]:
+                combined.append(order[1])
+            color_hex_dict[k_code] = ",%23".join([colors[number].lower() for number in combined])
 
     # for every k_code that is in the full annotation, but not included in any sets to highlight
     for k_code in gene_info_full:
@@ -121,28 +190,24 @@ def combine_hex_values(d):
 
 
 def _new_generate_url(self):  #
-    self.url = "http://www.kegg.jp/kegg-bin/show_pathway?map=" + self.map_code + "&multi_query="  # sets the which pathway to use
-
-    for k_code in self.genes_invol:  # goes through each unique k_code in pathway
-        self.url = self.url + k_code + "+%23" + color_hex_dict[k_code] + "%0a"  # adds gene's k_code to the end of the url and specifies color
+    # sets the which pathway to use, then adds each unique k_code in pathway to the end of the url and specifies color
+    self.url = "http://www.kegg.jp/kegg-bin/show_pathway?map=" + self.map_code + "&multi_query=" + \
+               "".join([k_code + "+%23" + color_hex_dict[k_code] + "%0a" for k_code in self.genes_invol])
 
     return self.url
-Pathway_MAP.generate_url = _new_generate_url  # overrides the generate_url method to include unique color value
 
 
-def make_html_table_rows(sorted_m_codes):
-    html_rows = ""
+def make_html_table_rows(sorted_m_codes):  # yields the html row of each pathway in sorted_m_codes
     for m_code in sorted_m_codes:
         # generates the text for the hyperlink (name + num of associated genes + percentage of genes out of total)
         query_pathway = pathway_info_query[m_code]
         full_pathway = pathway_info_full[m_code]
         hyper_text = query_pathway.name + "(" + str(len(query_pathway.genes_invol)) + ", " + \
-                     "{:.2f}%".format(len(query_pathway.genes_invol) / len(full_pathway.genes_invol) * 100) + ")"
+                     "{:.2f}%".format(pathway_coverage[m_code]) + ")"
         url = full_pathway.generate_url()  # generates the url
         hyperlink = "<a href=\"" + url + "\">" + hyper_text + "</a>"  # embeds hyperlink to text
         row = "<tr><td>" + hyperlink + "</td></tr>"
-        html_rows = html_rows + row
-    return html_rows
+        yield row
 
 
 class PathwayInfo:
@@ -157,8 +222,8 @@ class PathwayInfo:
 
 
 def generate_html(output_path):
-    with open(output_path, 'w+') as f:
-        html_code = """<html>
+    with open_output(output_path, 'w+') as f:  # the page is written as it is generated
+        f.write("""<html>
                 <head>
                 <style>
                     html {
@@ -295,9 +360,9 @@ def generate_html(output_path):
                 </style>
                 </head>
                 <body>
-                <body link="#003366">"""
+                <body link="#003366">""")
 
-        html_code = html_code + """
+        f.write("""
                 <br />
                 <div class="scrollingtable">
                     <div>
@@ -314,13 +379,13 @@ def generate_html(output_path):
                                     </tr>
                                 </thead>
                                 <tbody>
-                                    """
+                                    """)
         # sorts m_code by the number of highlighted genes in the table to iterate over dictionary in desired order
         # determines the order of the pathways in the html table
         sorted_m_code = sorted(pathway_info_query.keys(),
                                key=lambda m: len(pathway_info_query[m].genes_invol), reverse=True)
-        html_code = html_code + make_html_table_rows(sorted_m_code)
-        html_code = html_code + """</tbody>
+        f.writelines(make_html_table_rows(sorted_m_code))
+        f.write("""</tbody>
                             </table>
                         </div>
                     </div>
@@ -341,31 +406,137 @@ def generate_html(output_path):
                                     </tr>
                                 </thead>
                                 <tbody>
-                                    """
+                                    """)
         # sorts m_code alphabetically by pathway name to iterate over dictionary in desired order; determines the order
         # of the pathways in the html table
         sorted_m_code = sorted(pathway_info_query.keys(),
                                key=lambda m: pathway_info_query[m].name)
-        html_code = html_code + make_html_table_rows(sorted_m_code)
-        html_code = html_code + """</tbody>
+        f.writelines(make_html_table_rows(sorted_m_code))
+        f.write("""</tbody>
                             </table>
                         </div>
                     </div>
                 </div>
                 </body>
-                </html>"""
-        f.write(html_code)
+                </html>""")
     f.close()
 
 
+def export_html(output_path, mode = "blend"):  # colors the genes of sets_to_highlight on the pathways and writes the html page
+    generate_gene_info_query()
+    generate_pathway_info_query()
+    generate_color_hex_dict(mode)
+    generate_html(output_path)
+
+
+# colors every (path of a gene set file, color name or hex) of sets on the pathways of a data file without the window
+# mode is the way the colors of the genes of a k code are combined, one of blend_modes
+def export_pathways(data_file_path_full, sets, output_path, mode = "blend"):
+    for info in (sets_to_highlight, pathway_info_full, gene_info_full, gene_ids_full, color_hex_dict):
+        info.clear()  # forgets any previous export
+    load_full_annotation(data_file_path_full)
+    for set_input_path, color_text in sets:
+        if color_hex(color_text) is None:
+            raise ValueError(color_text + " is not a color name or color hex")
+        gene_set = load_set(set_input_path)
+        sets_to_highlight.setdefault(color_hex(color_text), set()).update(gene_set)  # sets of the same color are merged
+        report_unmatched(set_input_path, gene_set)
+    export_html(output_path, mode)
+
+
+# reads a manifest of configurations to export with export_batch(); the manifest is a json list of
+# {"output": path of the html file, "sets": [[path of a gene set file, color name or hex], ...], "blend": mode}
+# where "blend" may be left out; paths are relative to the folder of the manifest
+def load_manifest(manifest_path):
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r') as f:
+        configurations = json.load(f)
+    return [{"output": os.path.join(manifest_dir, configuration["output"]),
+             "sets": [(os.path.join(manifest_dir, set_input_path), color_text)
+                      for set_input_path, color_text in configuration["sets"]],
+             "blend": configuration.get("blend", "blend")} for configuration in configurations]
+
+
+# writes the html page of one configuration of export_batch(); sets is a list of (path in loaded_sets, color hex)
+def export_configuration(sets, output_path, mode = "blend"):
+    started = time.time()
+    result = {"output": output_path, "status": "ok", "error": "", "seconds": 0.0}
+    try:
+        sets_to_highlight.clear()
+        for set_input_path, color in sets:
+            # sets of the same color are merged; loaded_sets is shared by the configurations, so it is copied
+            sets_to_highlight.setdefault(color, set()).update(loaded_sets[set_input_path])
+        export_html(output_path, mode)
+    except Exception as error:
+        result["status"] = "failed"
+        result["error"] = type(error).__name__ + ": " + str(error)
+    result["seconds"] = round(time.time() - started, 3)
+    return result
+
+
+# colors the gene sets of every configuration (see load_manifest()) on the pathways of one data file without the window.
+# The data file, its pathway incidence and every gene set are read once, then the configurations are exported by up to
+# workers processes forked from this one, which share them. A configuration that fails does not stop the others
+def export_batch(data_file_path_full, configurations, workers = None):
+    if workers is None:
+        workers = GAEV._batch_workers
+    for info in (sets_to_highlight, pathway_info_full, gene_info_full, gene_ids_full, color_hex_dict, loaded_sets):
+        info.clear()  # forgets any previous export
+    load_full_annotation(data_file_path_full)
+    jobs = []  # (sets, output path, mode) of every configuration that could be prepared
+    results = {}  # result of every configuration by position in configurations
+    for number, configuration in enumerate(configurations):
+        try:
+            sets = []
+            for set_input_path, color_text in configuration["sets"]:
+                if color_hex(color_text) is None:
+                    raise ValueError(color_text + " is not a color name or color hex")
+                if set_input_path not in loaded_sets:  # gene sets used by several configurations are read once
+                    loaded_sets[set_input_path] = load_set(set_input_path)
+                    report_unmatched(set_input_path, loaded_sets[set_input_path])
+                sets.append((set_input_path, color_hex(color_text)))
+            jobs.append((number, sets, configuration["output"], configuration.get("blend", "blend")))
+        except (OSError, ValueError) as error:
+            results[number] = {"output": configuration["output"], "status": "failed",
+                               "error": type(error).__name__ + ": " + str(error), "seconds": 0.0}
+
+    jobs_output = {number: output_path for number, sets, output_path, mode in jobs}
+    workers = max(1, min(workers, len(jobs)))
+    print("Exporting " + str(len(configurations)) + " configurations, " + str(workers) + " at once")
+    if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context("fork")) as pool:
+            futures = {pool.submit(export_configuration, sets, output_path, mode): number
+                       for number, sets, output_path, mode in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as error:  # ex. the worker process was killed
+                    results[futures[future]] = {"output": jobs_output[futures[future]], "status": "failed",
+                                                "error": type(error).__name__ + ": " + str(error), "seconds": 0.0}
+    else:  # without fork the workers would have to read the data file again, so configurations are exported in turn
+        for number, sets, output_path, mode in jobs:
+            results[number] = export_configuration(sets, output_path, mode)
+
+    results = [results[number] for number in range(len(configurations))]
+    for result in results:
+        print(os.path.basename(result["output"]) + ": " + result["status"] + " (" + str(result["seconds"]) + " s)" +
+              (" " + result["error"] if result["error"] else ""))
+    return results
+
+
+# exports every configuration of a manifest file (see load_manifest()) with export_batch()
+def export_manifest(data_file_path_full, manifest_path, workers = None):
+    return export_batch(data_file_path_full, load_manifest(manifest_path), workers)
+
+
 class UI:
     color_dict: dict
     fields_dict: dict
 
     def __init__(self, root):
         # sets the color palette by creating dict with name as key and hex value as value
-        self.color_dict = {"blue": "7DF9FF", "purple": "DB70FF", "red": "FF261F", "orange": "FFAE42", "yellow": "FFF600",
-                           "green": "39FF14", "pink": "FF66CC", "brown": "AF6E4D"}
+        self.color_dict = color_names
 
         self.fields_dict = {}
         self.root = root
@@ -449,23 +620,20 @@ class UI:
 
         self.fields_dict["sets"].set(self.fields_dict["sets"].get() + input_path + "\n")
 
-        # adds list of gene ids and the color of those genes to the global list
-        sets_to_highlight[color_hex] = load_set(input_path)
+        # adds set of gene ids and the color of those genes to the global list
+        gene_set = load_set(input_path)
+        sets_to_highlight.setdefault(color_hex, set()).update(gene_set)  # sets of the same color are merged
+        message = report_unmatched(input_path, gene_set)
+        if message:
+            messagebox.showwarning(title="Warning", message=message)
 
     def input_color(self):  # prompts for color to set the fill color of the genes in the set on the pathway maps
         color_text = simpledialog.askstring(title="Choose color",
                                           prompt="Enter the highlight color for this set. Use the name of the color or input the color hex")
 
-        if color_text.lower() in self.color_dict:  # will accept color names (case-insensitive) set in color_dict
+        if color_hex(color_text):  # will accept color names (case-insensitive) set in color_dict or a color hex
             self.fields_dict["color"].set(self.fields_dict["color"].get() + color_text + "\n")
-            return self.color_dict[color_text.lower()]
-        elif len(color_text) == 6:  # else it will check if the input was a color hex
-            try:
-                int(color_text.upper(), 16)
-                self.fields_dict["color"].set(self.fields_dict["color"].get() + color_text + "\n")
-                return color_text.upper()
-            except ValueError:
-                pass
+            return color_hex(color_text)
 
         print(textwrap.dedent("""
                                  Color entered is not valid!"""))  # displays options for
@@ -482,14 +650,12 @@ class UI:
                                                    defaultextension='.html')
         print(output_path + '\n')
 
-        generate_gene_info_query()
-        generate_pathway_info_query()
-        generate_color_hex_dict()
-        generate_html(output_path)
+        export_html(output_path)
 
         self.root.destroy()
 
 
 if __name__ == "__main__":
+    Pathway_MAP.generate_url = _new_generate_url  # overrides the generate_url method to include unique color value
     root = tk.Tk()
     ui = UI(root)
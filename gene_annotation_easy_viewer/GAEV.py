@@ -4,14 +4,29 @@ import textwrap  # used when printing UI in order to remove common leading inden
 import os  # used to remove temporary files created and path manipulation
 import urllib  # to handle HTTPError exceptions raised from the urllib module
 from urllib.request import urlopen  # import the tools we need to open url
-import bisect  # module needed to insert an item into a sorted list
 import pickle  # needed to save and load data
 import sys  # needed to exit out of program when error is encountered
 import re  # required to split files without removing delimiter
+import sqlite3  # backs the persistent KO annotation cache shared between runs
+import time  # used to timestamp cached KO entries
+import threading  # guards the KO cache connection when it is shared
+import concurrent.futures  # used to keep several KEGG requests in flight at once
+import multiprocessing  # forks the workers that filter subsets of the loaded genes without copying them
+import io  # collects what the workers of a batch run print
+import random  # adds jitter to the wait between retries of failed requests
+import socket  # to recognize socket timeouts raised while reading a url
+import http.client  # to recognize dropped connections raised while reading a url
+import struct  # packs the fixed size header of version 2 data files
+import gzip  # optional compression of data file sections
+import lzma  # optional compression of data file sections
+import json  # stores the provenance of a data file
+import mmap  # lets large data files be read lazily without loading every gene
+try:
+    import numpy  # optional; vectorizes the operations on the pathway incidence when installed
+except ImportError:
+    numpy = None
+import argparse  # reads the command line arguments of the pipeline
 import copy
-import tkinter as tk
-from tkinter import filedialog, messagebox, simpledialog
-from tkinter import *
 
 ############ Variables ############
 _input_file = "No_File_Specified"  # will store path of the input file
@@ -19,30 +34,556 @@ _trimmed_file = "No_File_Specified"  # will store path of the trimmed input file
 _data_file = "No_File_Specified" # will store path to the data file code will generate
 _html_file = "No_File_Specified" # will store path to the html file that will display the data
 _pathway_list = []  # will store pathway list loaded from data file
-_gene_list = []  # will store gene list loaded from data file
+_pathway_index = {}  # will store every pathway loaded from data file by map code {map_code: Pathway_MAP}
+_gene_list = []  # will store gene list loaded from data file (a Gene_View once a data file is loaded)
 _total_genes = 0  # will store the total number of genes when unfiltered
+# filters applied to the loaded genes, in order [(description, _gene_list before the filter), ...]; the views share the
+# genes loaded from the data file, so filters can be undone or removed without loading it again
+_filter_stack = []
+_filtered_pathways = None  # will store (_gene_list, pathways linked to its genes) once filtered_pathways() computes it
+_filter_index = None  # will store the Filter_Index of the loaded genes once a filter needs it
+_incidence = None  # will store the Pathway_Incidence of the loaded genes and pathways once it is needed
+_subset_index = None  # will store the gene_id_positions() of _gene_list while the subsets of a batch are filtered
+_dat_compression = "none"  # compression of new data files: "none", "gzip" or "lzma"
+_dat_block_size = 1024  # number of genes stored together in one block of a data file
+_lazy_threshold = 200000  # data files with more genes than this are read lazily instead of loaded into memory
+_html_buffer_size = 1 << 20  # bytes of output collected in memory before they are written to an html file
+# base url of the KEGG REST API; GAEV_KEGG_URL may point it to a mirror or a local stand-in server
+_kegg_rest_url = os.environ.get("GAEV_KEGG_URL", "http://rest.kegg.jp")
+_fetch_workers = 8  # max number of KEGG requests kept in flight at once
+_kegg_batch_size = 10  # number of k codes requested from KEGG's "get" site at once (KEGG allows up to 10)
+_url_timeout = 30  # seconds connecting to or reading from KEGG may stall before the request is abandoned
+_url_retries = 5  # number of times a request that failed with a temporary error is retried
+_retry_backoff = 2  # seconds waited before the first retry; doubles with every further retry
+_retry_backoff_max = 120  # longest wait in seconds between two retries
+_deferred_rounds = 2  # number of times the k codes that still failed are retried at the end of a run
+# path to the persistent KO annotation cache shared by every GAEV run; set GAEV_KO_CACHE to "" to disable the cache
+_ko_cache_file = os.environ.get("GAEV_KO_CACHE", os.path.join(os.path.expanduser("~"), ".gaev_ko_cache.sqlite"))
+_ko_cache_ttl = 30 * 24 * 60 * 60  # seconds a cached KO entry stays valid before it is fetched again (30 days)
+_ko_cache_max_entries = 100000  # max number of KO entries kept; least recently used entries are evicted past this
+_ko_cache_check_release = True  # if True, the cache is emptied whenever KEGG reports a new release
+_ko_cache = None  # will store the KO_Cache object once it has been opened
+_kegg_release = None  # will store the KEGG release reported when the KO cache was opened
+# path to a KO index built from downloaded KEGG files; when set, annotation never accesses KEGG (offline mode)
+_offline_index_file = os.environ.get("GAEV_OFFLINE_INDEX", "")
+_offline_index = None  # will store the KO_Index object once it has been opened
+# number of files of a batch run processed at once, each in its own process; GAEV_BATCH_WORKERS may set another number
+_batch_workers = int(os.environ.get("GAEV_BATCH_WORKERS") or os.cpu_count() or 1)
+_batch_manifest_file = "batch_manifest.json"  # summary of the last batch run, written to the current directory
+_shared_k_codes = {}  # k codes resolved once for every input file of a batch run {k_code: [NAME, DEFINITION, [pathways]]}
 
 ############ Classes and Functions ############
-def decode_url(urlLink):  # converts HTML response into String (allows program to read webpages)
-    while True:  # will loop forever until connection with url is made
-        with contextlib.closing(urlopen(urlLink)) as response:  # opening the url gives us HTML response variables instead of String
-            html_response = response.read()
-            encoding = response.headers.get_content_charset('utf-8')  # handles the encoding from Content-Type
-            decoded_html = html_response.decode(encoding)
-        response.close()
-        return decoded_html  # returns the decoded html as String
-
-def save(geneList, pathwayList, completed):
+def decode_url(urlLink, retries = None):  # converts HTML response into String (allows program to read webpages)
+    # temporary errors (dropped connections, timeouts, HTTP 429/5xx) are retried with exponential backoff and jitter;
+    # permanent errors (ex. HTTP 404) and the last temporary error are raised to the caller
+    if retries is None:  # if the number of retries is not specified, use the global number
+        retries = _url_retries
+    attempt = 0  # number of attempts that already failed
+    while True:  # will loop until the url is read or the error is permanent or retries run out
+        try:
+            with contextlib.closing(urlopen(urlLink, timeout=_url_timeout)) as response:  # opening the url gives us HTML response variables instead of String
+                html_response = response.read()
+                encoding = response.headers.get_content_charset('utf-8')  # handles the encoding from Content-Type
+                decoded_html = html_response.decode(encoding)
+            response.close()
+            return decoded_html  # returns the decoded html as String
+        except Exception as error:
+            if attempt >= retries or not is_retryable(error):
+                raise
+            wait = min(_retry_backoff_max, _retry_backoff * 2 ** attempt)
+            retry_after = error.headers.get("Retry-After") if isinstance(error, urllib.error.HTTPError) else None
+            if retry_after and retry_after.isdigit():  # KEGG asked to wait a specific number of seconds
+                wait = max(wait, int(retry_after))
+            attempt = attempt + 1
+            time.sleep(random.uniform(wait / 2, wait))  # jitter keeps parallel workers from retrying in lockstep
+
+def is_retryable(error):  # classifies an error raised while reading a url as temporary (True) or permanent (False)
+    if isinstance(error, urllib.error.HTTPError):  # the server answered, so only some status codes are worth retrying
+        return error.code in (408, 429, 500, 502, 503, 504)
+    if isinstance(error, urllib.error.URLError):  # the server could not be reached; the reason tells why
+        error = error.reason
+    return isinstance(error, (ConnectionError, TimeoutError, socket.timeout, socket.gaierror,
+                              http.client.IncompleteRead, http.client.BadStatusLine))
+
+def save(geneList, pathwayList, completed, data_file = None, provenance = None):
     global _data_file  # sets local _data_file to global _data_file
-    with open(_data_file, "wb") as f:  # create a file to save/pickle data
-        pickle.dump(completed, f)
-        pickle.dump(len(geneList), f)  # store the amount of data entries for genes
-        for gene in geneList:  # loops through and store all all data in geneList
-            pickle.dump(gene, f)
-        pickle.dump(len(pathwayList), f)  # store the amount of data entries for pathways
-        for pathway in pathwayList:  # loops through and store all data in pathwayList
-            pickle.dump(pathway, f)
-    f.close()
+    if data_file == None:  # if a path to the data_file was not specify,
+        data_file = _data_file  # use the path that was most recently stored
+    write_data_file(data_file, geneList, pathwayList, completed, provenance=provenance)
+
+############ Data Files ############
+# version 2 data files start with a fixed size header followed by independent sections:
+#   magic, version, completed, compression, block size, gene count, pathway count,
+#   then (offset, length) of the provenance, gene block index, gene blocks and pathway sections
+# genes are pickled in blocks of _dat_block_size genes so any block can be read without reading the others
+# version 1 data files (older GAEV) are a bare stream of pickles: completed, gene count, genes, pathway count, pathways
+_dat_magic = b"GAEVDAT2"
+_dat_header = struct.Struct("<8sHBBIQQ" + "QQ" * 4)
+_dat_codecs = {"none": 0, "gzip": 1, "lzma": 2}  # compression name -> code stored in the header
+
+class Data_Unpickler(pickle.Unpickler):  # reads the Gene and Pathway_MAP objects of data files and journals
+    # the objects are pickled with the name of the module that wrote them, which is __main__ when GAEV.py is run as a
+    # script; they are read as objects of this module however GAEV was started, ex. imported by another script
+    def find_class(self, module, name):
+        if module in ("__main__", "GAEV") and name in ("Gene", "Pathway_MAP"):
+            return globals()[name]
+        return super().find_class(module, name)
+
+def unpickle(f):  # reads the next pickled object of an open file
+    return Data_Unpickler(f).load()
+
+def unpickle_bytes(data):  # reads an object pickled in bytes, ex. a section of a data file
+    return Data_Unpickler(io.BytesIO(data)).load()
+
+def compress_section(data, code):
+    if code == 1:
+        return gzip.compress(data, compresslevel=6)
+    if code == 2:
+        return lzma.compress(data)
+    return data
+
+def decompress_section(data, code):
+    if code == 1:
+        return gzip.decompress(data)
+    if code == 2:
+        return lzma.decompress(data)
+    return data
+
+def write_data_file(data_file, geneList, pathwayList, completed = True, compression = None, provenance = None):
+    if compression is None:  # if no compression is specified, use the global setting
+        compression = _dat_compression
+    code = _dat_codecs[compression]
+    info = {"created": time.strftime("%Y-%m-%d %H:%M:%S")}  # provenance of the data file
+    info.update(provenance or {})
+    temp_file = data_file + ".tmp"  # data is written next to the data file first, so a crash never corrupts it
+    with open(temp_file, "wb") as f:  # create a file to save/pickle data
+        f.write(b"\0" * _dat_header.size)  # the header is written last, once the offsets are known
+        sections = []  # (offset, length) of each section
+        block_index = []  # (offset, length) of each gene block
+
+        offset = f.tell()
+        f.write(json.dumps(info).encode("utf-8"))
+        sections.append((offset, f.tell() - offset))
+
+        blocks_start = f.tell()
+        for i in range(0, len(geneList), _dat_block_size):  # loops through and store all data in geneList by blocks
+            block = compress_section(pickle.dumps(list(geneList[i:i + _dat_block_size]), pickle.HIGHEST_PROTOCOL), code)
+            block_index.append((f.tell(), len(block)))
+            f.write(block)
+        blocks = (blocks_start, f.tell() - blocks_start)
+
+        offset = f.tell()
+        f.write(b"".join(struct.pack("<QQ", block_offset, length) for block_offset, length in block_index))
+        sections.append((offset, f.tell() - offset))
+        sections.append(blocks)
+
+        offset = f.tell()  # stores all data in pathwayList as a registry keyed by map code
+        f.write(compress_section(pickle.dumps(index_pathways(pathwayList), pickle.HIGHEST_PROTOCOL), code))
+        sections.append((offset, f.tell() - offset))
+
+        f.seek(0)
+        f.write(_dat_header.pack(_dat_magic, 2, bool(completed), code, _dat_block_size, len(geneList),
+                                 len(pathwayList), *[value for section in sections for value in section]))
+        f.flush()
+        os.fsync(f.fileno())  # makes sure the data is on disk before it replaces the data file
+    os.replace(temp_file, data_file)  # atomically swaps the new data file in place of the old one
+
+def upgrade_data_file(data_file):  # rewrites a version 1 data file in the version 2 format; returns False if it already is
+    # loading never changes a data file, so this is the only step that converts one (see also 'GAEV.py upgrade')
+    header = read_data_header(data_file)
+    if header["version"] != 1:
+        return False
+    genes = list(read_data_genes(data_file, header))
+    pathways = read_data_pathways(data_file, header)
+    write_data_file(data_file, genes, pathways, header["completed"], provenance={"upgraded_from": 1})
+    return True
+
+def read_data_header(data_file):  # reads the header of a data file without reading its genes or pathways
+    # returns a dict with version, completed, gene_count, pathway_count, compression, provenance and section offsets
+    with open(data_file, "rb") as f:
+        head = f.read(_dat_header.size)
+        if not head.startswith(_dat_magic):  # version 1 data file; only the first two pickles need to be read
+            f.seek(0)
+            completed = unpickle(f)  # the first line of saved data tells whether it is complete or not
+            gene_count = unpickle(f)
+            return {"version": 1, "completed": completed, "gene_count": gene_count, "pathway_count": None,
+                    "compression": "none", "provenance": {}}
+        if len(head) < _dat_header.size:
+            raise ValueError(data_file + " is truncated")
+        fields = _dat_header.unpack(head)
+        header = {"version": fields[1], "completed": bool(fields[2]),
+                  "compression": [name for name, code in _dat_codecs.items() if code == fields[3]][0],
+                  "code": fields[3], "block_size": fields[4], "gene_count": fields[5], "pathway_count": fields[6],
+                  "sections": [fields[7 + 2 * i: 9 + 2 * i] for i in range(4)]}
+        offset, length = header["sections"][0]
+        f.seek(offset)
+        header["provenance"] = json.loads(f.read(length).decode("utf-8"))
+        offset, length = header["sections"][1]
+        f.seek(offset)
+        index = f.read(length)
+        header["blocks"] = [struct.unpack_from("<QQ", index, i) for i in range(0, length, 16)]  # (offset, length)
+    return header
+
+def read_data_genes(data_file, header = None):  # yields every gene of a data file in order, one block at a time
+    if header is None:
+        header = read_data_header(data_file)
+    with open(data_file, "rb") as f:
+        if header["version"] == 1:
+            unpickle(f)  # skips the completed flag
+            for _ in range(unpickle(f)):  # reads line that tells program how many data entries there are in genes
+                yield unpickle(f)
+            return
+        for offset, length in header["blocks"]:
+            f.seek(offset)
+            yield from unpickle_bytes(decompress_section(f.read(length), header["code"]))
+
+def read_data_pathways(data_file, header = None):  # returns the list of pathways of a data file
+    return list(read_data_pathway_index(data_file, header).values())
+
+def read_data_pathway_index(data_file, header = None):  # returns the pathways of a data file by map code
+    if header is None:
+        header = read_data_header(data_file)
+    if header["version"] == 1:  # the pathways come after every gene, so the genes have to be read first
+        with open(data_file, "rb") as f:
+            unpickle(f)  # skips the completed flag
+            for _ in range(unpickle(f)):
+                unpickle(f)
+            return index_pathways([unpickle(f) for _ in range(unpickle(f))])
+    offset, length = header["sections"][3]
+    with open(data_file, "rb") as f:
+        f.seek(offset)
+        return unpickle_bytes(decompress_section(f.read(length), header["code"]))
+
+def index_pathways(pathwayList):  # returns a registry of the pathways keyed by map code {map_code: Pathway_MAP}
+    return {pathway.map_code: pathway for pathway in pathwayList}
+
+class Gene_Records:  # read-only sequence over the genes of a version 2 data file
+    # the file is memory-mapped and genes are only unpickled when accessed, one block at a time, so a data file of
+    # any size can be used without holding all of its genes in memory
+    def __init__(self, data_file, header = None):
+        if header is None:
+            header = read_data_header(data_file)
+        if header["version"] == 1:
+            raise ValueError(data_file + " must be upgraded to the version 2 format to be read lazily")
+        self.header = header
+        self.block_size = header["block_size"]
+        self.file = open(data_file, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.block_number = None  # number of the block decoded last
+        self.block = []  # genes of the block decoded last
+
+    def read_block(self, block_number):  # unpickles every gene of one block
+        offset, length = self.header["blocks"][block_number]
+        return unpickle_bytes(decompress_section(self.map[offset:offset + length], self.header["code"]))
+
+    def __len__(self):
+        return self.header["gene_count"]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i = i + len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("gene index out of range")
+        block_number = i // self.block_size
+        if block_number != self.block_number:  # only the last block is kept, so indices should be read in order
+            self.block = self.read_block(block_number)
+            self.block_number = block_number
+        return self.block[i % self.block_size]
+
+    def __iter__(self):  # streams every gene, one block at a time
+        for block_number in range(len(self.header["blocks"])):
+            yield from self.read_block(block_number)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class Gene_View:  # list-like view of the genes kept by the filters
+    # source is the list or Gene_Records holding every loaded gene and indices are the positions of the genes kept,
+    # in order (None keeps every gene); filtering creates a new view without copying any Gene object
+    def __init__(self, source, indices = None):
+        self.source = source
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.source) if self.indices is None else len(self.indices)
+
+    def __iter__(self):
+        if self.indices is None:
+            return iter(self.source)
+        return (self.source[i] for i in self.indices)
+
+    def __getitem__(self, i):
+        return self.source[i] if self.indices is None else self.source[self.indices[i]]
+
+    def positions(self):  # positions of the genes of this view in source
+        return range(len(self.source)) if self.indices is None else self.indices
+
+    def filter(self, predicate):  # returns a new view with only the genes for which predicate(gene) is True
+        return Gene_View(self.source, [i for i, gene in zip(self.positions(), self) if predicate(gene)])
+
+    def select(self, positions):  # returns a new view with only the genes whose position in source is in positions
+        return Gene_View(self.source, [i for i in self.positions() if i in positions])
+
+_journal_header = ("GAEV checkpoint journal", 2)  # first record of every checkpoint journal
+
+def read_journal(journal_file):  # reads the genes and pathways recorded in a checkpoint journal
+    # returns the list of genes, the list of pathways and the byte offset where the last complete record ends; a record
+    # cut short by a crash is ignored. Each pathway is recorded before the first gene that links to it
+    genes = []
+    pathways = []
+    offset = 0  # offset right after the last record that could be read completely
+    with open(journal_file, "rb") as f:
+        try:
+            if unpickle(f) != _journal_header:  # not a journal written by this version of GAEV
+                return genes, pathways, offset
+            offset = f.tell()
+            while True:
+                record = unpickle(f)
+                (pathways if isinstance(record, Pathway_MAP) else genes).append(record)
+                offset = f.tell()
+        except (EOFError, pickle.UnpicklingError, AttributeError, ValueError, IndexError):  # end of the journal
+            pass
+    return genes, pathways, offset
+
+def pathway_codes(link_path):  # returns the shared map codes of a list like ['map_code map_name', ...] as a tuple
+    return tuple([sys.intern(path_info.split(None, 1)[0]) for path_info in link_path])
+
+def add_to_pathways(gene, pathwayList, pathway_index, path_infos = ()):  # adds gene to every pathway in its link_path
+    # pathways not seen before are created from path_infos ['map_code map_name', ...] and added to both pathwayList
+    # and the registry pathway_index; returns the pathways that were created
+    new_pathways = []
+    for path_info in path_infos:
+        m_code = path_info.split(None, 1)[0]  # cuts the map code from the map code + map name
+        if m_code not in pathway_index:  # if this is the first time encountering this pathway
+            pathway_index[m_code] = Pathway_MAP(path_info)  # it creates a new pathway object
+            pathwayList.append(pathway_index[m_code])
+            new_pathways.append(pathway_index[m_code])
+    for m_code in gene.link_path:  # runs for each pathway the gene was associated with
+        pathway_index[m_code].add_gene(gene.k_code)  # adds gene to that pathway
+    return new_pathways
+
+class KO_Cache:  # persistent on-disk store of parsed KO entries keyed by k code (SQLite in WAL mode)
+    def __init__(self, path, ttl = None, max_entries = None):
+        self.path = path
+        self.ttl = ttl  # seconds an entry is valid for; None never expires entries
+        self.max_entries = max_entries  # max number of entries; None never evicts entries
+        self.lock = threading.Lock()  # one connection is shared by every thread of this process
+        # timeout makes other GAEV processes wait for a writer instead of failing; autocommit outside explicit transactions
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")  # readers never block the writer and vice versa
+        self.conn.execute("PRAGMA synchronous=NORMAL")  # safe in WAL mode and much faster than FULL
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS ko (k_code TEXT PRIMARY KEY, symbol TEXT, name TEXT, "
+                              "pathway TEXT, fetched REAL, used REAL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ko_used ON ko (used)")  # lets LRU eviction find oldest entries
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("COMMIT")
+
+    def check_release(self, release):  # empties the cache if it was filled from a different KEGG release
+        # only the release numbers are compared; KEGG updates the date part daily, which the ttl already covers
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'release'").fetchone()
+            if row is None or release_number(row[0]) != release_number(release):
+                if row is not None:
+                    print("KEGG release changed (" + row[0] + " -> " + release + "). Clearing KO cache.")
+                    self.conn.execute("DELETE FROM ko")
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('release', ?)", (release,))
+            self.conn.execute("COMMIT")
+
+    def get_many(self, k_codes):  # returns {k_code: [NAME, DEFINITION, [pathways]]} for every fresh cached k code
+        found = {}
+        k_codes = list(k_codes)
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for i in range(0, len(k_codes), 500):  # stays below SQLite's limit on query parameters
+                chunk = k_codes[i:i + 500]
+                rows = self.conn.execute("SELECT k_code, symbol, name, pathway, fetched FROM ko WHERE k_code IN (" +
+                                         ",".join("?" * len(chunk)) + ")", chunk).fetchall()
+                for k_code, symbol, name, pathway, fetched in rows:
+                    if self.ttl is None or now - fetched < self.ttl:  # stale entries are treated as missing
+                        found[k_code] = [symbol, name, pathway.split("\n") if pathway else []]
+            self.conn.executemany("UPDATE ko SET used = ? WHERE k_code = ?", [(now, k) for k in found])  # LRU stamp
+            self.conn.execute("COMMIT")
+        return found
+
+    def get(self, k_code):  # returns the cached info list of one k code or None if it is missing or stale
+        return self.get_many([k_code]).get(k_code)
+
+    def put_many(self, entries):  # stores {k_code: [NAME, DEFINITION, [pathways]]} and evicts past max_entries
+        now = time.time()
+        rows = [(k_code, info[0], info[1], "\n".join(info[2]), now, now) for k_code, info in entries.items()]
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("INSERT OR REPLACE INTO ko (k_code, symbol, name, pathway, fetched, used) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            if self.max_entries is not None:
+                excess = self.conn.execute("SELECT COUNT(*) FROM ko").fetchone()[0] - self.max_entries
+                if excess > 0:  # evicts the least recently used entries
+                    self.conn.execute("DELETE FROM ko WHERE k_code IN "
+                                      "(SELECT k_code FROM ko ORDER BY used LIMIT ?)", (excess,))
+            self.conn.execute("COMMIT")
+
+    def put(self, k_code, info):
+        self.put_many({k_code: info})
+
+    def close(self):
+        self.conn.close()
+
+def get_kegg_release():  # returns the release string of the KEGG Orthology database, ex. "108.0+/10-18, Oct 23"
+    for line in decode_url(_kegg_rest_url + '/info/ko', retries=1).splitlines():  # not worth a long wait
+        if "Release" in line:
+            return line.split("Release", 1)[1].strip()
+    return None
+
+def release_number(release):  # returns the number of a KEGG release string, ex. "108.0" for "108.0+/10-18, Oct 23"
+    match = re.match(r"\d+(\.\d+)?", release)
+    return match.group() if match else release
+
+def open_ko_cache():  # opens the KO cache on first use; returns None if the cache is disabled or cannot be opened
+    global _ko_cache  # sets local _ko_cache to global _ko_cache
+    if _ko_cache is None and _ko_cache_file:
+        try:
+            _ko_cache = KO_Cache(_ko_cache_file, _ko_cache_ttl, _ko_cache_max_entries)
+        except sqlite3.Error as error:  # ex. read-only home directory; GAEV still works, only slower
+            print("KO cache disabled (" + str(error) + ")")
+            return None
+        if _ko_cache_check_release:
+            try:
+                release = get_kegg_release()
+            except (urllib.error.URLError, OSError):  # if KEGG cannot be reached, keep using the cached entries
+                release = None
+            if release:
+                _ko_cache.check_release(release)
+                global _kegg_release  # sets local _kegg_release to global _kegg_release
+                _kegg_release = release
+    return _ko_cache
+
+class KO_Index:  # local store of KEGG KO data compiled from downloaded KEGG files, used for offline annotation
+    def __init__(self, path, read_only = True):
+        self.path = path
+        if read_only:  # opens the index without ever writing to it, so it can sit on a shared read-only file system
+            self.conn = sqlite3.connect("file:" + urllib.request.pathname2url(os.path.abspath(path)) + "?mode=ro",
+                                        uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            # every row is kept per source file, so files adding the same k code do not replace each other
+            self.conn.execute("CREATE TABLE IF NOT EXISTS ko (k_code TEXT, symbol TEXT, name TEXT, source TEXT, "
+                              "PRIMARY KEY (k_code, source)) WITHOUT ROWID")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS ko_pathway (k_code TEXT, map_code TEXT, source TEXT, "
+                              "PRIMARY KEY (k_code, map_code, source)) WITHOUT ROWID")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS pathway (map_code TEXT, name TEXT, source TEXT, "
+                              "PRIMARY KEY (map_code, source)) WITHOUT ROWID")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, size INTEGER, mtime REAL)")
+            self.conn.commit()
+        self.conn.execute("PRAGMA mmap_size = 1073741824")  # reads the index through a memory map instead of read()
+
+    def add_file(self, kegg_file):  # compiles one KEGG file into the index; unchanged files are skipped
+        # accepts the 'ko' flat file, or the tab separated 'list/ko', 'link/pathway/ko' (or 'link/ko/pathway') and
+        # 'list/pathway' files
+        kegg_file = os.path.abspath(kegg_file)
+        stat = os.stat(kegg_file)
+        row = self.conn.execute("SELECT size, mtime FROM sources WHERE path = ?", (kegg_file,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return False  # the file was already compiled and has not changed since
+        with self.conn:  # one transaction per file
+            for table in ["ko", "ko_pathway", "pathway"]:  # removes what an older copy of this file added
+                self.conn.execute("DELETE FROM " + table + " WHERE source = ?", (kegg_file,))
+            with open(kegg_file, 'r') as f:
+                first_line = next((line for line in f if line.strip()), "")
+                f.seek(0)
+                if first_line.startswith("ENTRY"):
+                    self.add_flat_file(f, kegg_file)
+                else:
+                    self.add_tab_file(f, kegg_file)
+            self.conn.execute("INSERT OR REPLACE INTO sources (path, size, mtime) VALUES (?, ?, ?)",
+                              (kegg_file, stat.st_size, stat.st_mtime))
+        return True
+
+    def add_flat_file(self, f, source):  # compiles the 'ko' flat file (entries separated by '///')
+        entry_lines = []
+        for line in f:
+            if line.startswith('///'):
+                if entry_lines and entry_lines[0].startswith('ENTRY'):
+                    k_code = entry_lines[0].split()[1]  # ex line: ENTRY       K00001                      KO
+                    name, definition, link_path = parse_ko_entry("".join(entry_lines))
+                    self.conn.execute("INSERT OR REPLACE INTO ko (k_code, symbol, name, source) VALUES (?, ?, ?, ?)",
+                                      (k_code, name, definition, source))
+                    for path_info in link_path:  # ex: map00010  Glycolysis / Gluconeogenesis
+                        m_code, m_name = (path_info.split(None, 1) + [''])[:2]
+                        self.conn.execute("INSERT OR REPLACE INTO ko_pathway (k_code, map_code, source) VALUES (?, ?, ?)",
+                                          (k_code, m_code, source))
+                        self.conn.execute("INSERT OR IGNORE INTO pathway (map_code, name, source) VALUES (?, ?, ?)",
+                                          (m_code, m_name, source))
+                entry_lines = []
+            else:
+                entry_lines.append(line)
+
+    def add_tab_file(self, f, source):  # compiles 'list/ko', 'link/pathway/ko' or 'list/pathway' (two tab separated columns)
+        for line in f:
+            column = line.rstrip("\n").split("\t")
+            if len(column) != 2:
+                continue
+            left = column[0].split(":")[-1]  # removes the 'path:' and 'ko:' prefixes
+            right = column[1].split(":")[-1] if column[1].startswith(("ko:", "path:")) else column[1]
+            if re.match(r"K\d{5}$", left) and re.match(r"(map|ko)\d{5}$", right):  # link/ko/pathway line
+                left, right = right, left  # same link as in link/pathway/ko, with the columns the other way around
+            if re.match(r"(map|ko)\d{5}$", left) and re.match(r"K\d{5}$", right):  # link/pathway/ko line
+                if left.startswith("map"):  # every map pathway is also listed as a ko pathway, which is skipped
+                    self.conn.execute("INSERT OR REPLACE INTO ko_pathway (k_code, map_code, source) VALUES (?, ?, ?)",
+                                      (right, left, source))
+            elif re.match(r"(map|ko)\d{5}$", left):  # list/pathway line, ex: path:map00010	Glycolysis / Gluconeogenesis
+                self.conn.execute("INSERT OR REPLACE INTO pathway (map_code, name, source) VALUES (?, ?, ?)",
+                                  ("map" + left[-5:], column[1], source))
+            elif re.match(r"K\d{5}$", left):  # list/ko line, ex: ko:K00001	E1.1.1.1, adh; alcohol dehydrogenase
+                symbol, definition = (column[1].split("; ", 1) + [''])[:2] if "; " in column[1] else ['', column[1]]
+                self.conn.execute("INSERT OR REPLACE INTO ko (k_code, symbol, name, source) VALUES (?, ?, ?, ?)",
+                                  (left, symbol, definition, source))
+
+    def get_many(self, k_codes):  # returns {k_code: [NAME, DEFINITION, [map_code map_name, ...]]} for every k code
+        # a k code added by several files gets the first symbol and name any of them has, in the order of the file paths;
+        # a pathway without a name in any file (ex. only link/pathway/ko was added) is named after its map code
+        found = {}
+        k_codes = list(k_codes)
+        for i in range(0, len(k_codes), 500):  # stays below SQLite's limit on query parameters
+            chunk = k_codes[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            for k_code, symbol, name in self.conn.execute("SELECT k_code, symbol, name FROM ko WHERE k_code IN (" +
+                                                          marks + ") ORDER BY k_code, source", chunk):
+                info = found.setdefault(k_code, ['', '', []])
+                info[0] = info[0] or symbol
+                info[1] = info[1] or name
+            for k_code, m_code, m_name in self.conn.execute(
+                    "SELECT kp.k_code, kp.map_code, COALESCE((SELECT MIN(p.name) FROM pathway p WHERE "
+                    "p.map_code = kp.map_code AND p.name != ''), kp.map_code) FROM (SELECT DISTINCT k_code, map_code "
+                    "FROM ko_pathway WHERE k_code IN (" + marks + ")) kp ORDER BY kp.k_code, kp.map_code", chunk):
+                found.setdefault(k_code, ['', '', []])[2].append(m_code + "  " + m_name)  # same format as KEGG's "get" site
+        return {k_code: found.get(k_code, ['', '', []]) for k_code in k_codes}  # unknown k codes get the usual fallback
+
+    def close(self):
+        self.conn.close()
+
+def build_offline_index(index_file, kegg_files):  # compiles downloaded KEGG files into the KO index at index_file
+    index = KO_Index(index_file, read_only=False)
+    try:
+        for kegg_file in kegg_files:
+            if index.add_file(kegg_file):
+                print("Added " + kegg_file + " to " + index_file)
+            else:
+                print(kegg_file + " is unchanged; skipped")
+    finally:
+        index.close()
+
+def open_offline_index():  # opens the KO index on first use; returns None when GAEV is not in offline mode
+    global _offline_index  # sets local _offline_index to global _offline_index
+    if _offline_index is None and _offline_index_file:
+        if not os.path.isfile(_offline_index_file):
+            sys.exit("No offline KEGG index found at " + _offline_index_file)
+        _offline_index = KO_Index(_offline_index_file)
+    return _offline_index
 
 def separate_file(path):  # accepts path as string and separates the file name ['C:/ExampleFolder/', 'FileName']
     path_list = re.split("(/)", path)  # separates the string at every "/" while keeping the delimiter
@@ -83,26 +624,44 @@ def set_data_file(data_file = None):  # will specify path to data file to be use
     name_no_ext, ext = os.path.splitext(data_file)  # stores file name w/o ext in name_no_ext and the extension in ext
     _html_file = os.path.join(os.path.dirname(data_file),  name_no_ext + ".html")  # creates path to html file
 
-def load_data(data_file = None):  # will load data from data file into _gene_list and _pathway_list
+def load_data(data_file = None, lazy = None):  # will load data from data file into _gene_list and _pathway_list
+    # lazy=True reads genes from the data file on access instead of loading them all; None decides by _lazy_threshold
     global _data_file  # sets local _data_file to global _data_file
     global _pathway_list  # sets local _pathway_list to global _pathway_list
     global _gene_list  # sets local _gene_list to global _gene_list
     global _total_genes  # sets local _total_genes to global _gene_list
 
+    global _pathway_index  # sets local _pathway_index to global _pathway_index
+    global _filter_index  # sets local _filter_index to global _filter_index
+    global _incidence  # sets local _incidence to global _incidence
+    global _filtered_pathways  # sets local _filtered_pathways to global _filtered_pathways
     del _pathway_list[:]  # clears _pathway_list to prevent appending one data set onto another
-    del _gene_list[:]  # clears _gene_list to prevent appending one data set onto another
+    del _filter_stack[:]  # filters of the previous genes do not apply to the new ones
+    _filter_index = None  # the filter index and incidence of the previous genes are no longer needed
+    _incidence = None
+    _filtered_pathways = None
+    if isinstance(_gene_list, Gene_View) and isinstance(_gene_list.source, Gene_Records):
+        _gene_list.source.close()  # releases the data file read lazily before
 
     if data_file == None:  # if a path to the data_file was not specify,
         data_file = _data_file # use the path that was most recently stored
-    with open(data_file, "rb") as f:  # open data file that was generated previously
-        if not pickle.load(f):  # reads the first line of saved data which tells whether it is complete or not
-            sys.exit("Data is not complete")  # exits program if data is not complete
-
-        for _ in range(pickle.load(f)):  # reads line that tells program how many data entries there are in genes
-            _gene_list.append(pickle.load(f))  # loads data into _gene_list
-        for _ in range(pickle.load(f)):  # reads line that tells program how many data entries there are in pathways
-            _pathway_list.append(pickle.load(f))  # loads data into _pathway_list
-
+    header = read_data_header(data_file)  # reads the header which tells whether the data is complete or not
+    if not header["completed"]:
+        sys.exit("Data is not complete")  # exits program if data is not complete
+    if lazy is None:
+        lazy = header["gene_count"] > _lazy_threshold
+
+    if header["version"] == 1:  # data files from older versions of GAEV are read into memory as they are
+        print(os.path.basename(data_file) + " was made by an older version of GAEV; run 'python GAEV.py upgrade " +
+              os.path.basename(data_file) + "' to load it faster")
+        lazy = False  # only version 2 data files can be read lazily
+    _pathway_index = read_data_pathway_index(data_file, header)
+    _pathway_list.extend(_pathway_index.values())  # loads data into _pathway_list
+
+    if lazy:
+        _gene_list = Gene_View(Gene_Records(data_file, header))  # genes are read from the data file on access
+    else:
+        _gene_list = Gene_View(list(read_data_genes(data_file, header)))  # loads data into _gene_list
     _total_genes = len(_gene_list)
 
 def retrieve_batch_files(data):
@@ -117,43 +676,508 @@ def retrieve_batch_files(data):
                 file_list.append(file_path)  # add the input file path to the input_file_list
     return file_list
 
-def take_subset(trimmed_filter_file):
-    global _gene_list  # uses the global variable _gene_list
-
-    filter_list = []  # stores list of geneIDs extracted from the trimmed_filter_file to filter the data by
-    with open(trimmed_filter_file, 'r') as tf:  # opens the file at path trimmed_filter_file to read
-        for line in tf:  # goes through the each line of the file; should contain one geneID and K number per line
-            GeneID, K_number = line.split()  # separates the geneID from the K number
-            filter_list.append(GeneID)  # add the geneID to the filter list; by the end, all geneIDs should be added
-    _gene_list[:] = [gene for gene in _gene_list if gene.gene_num in filter_list]
-    os.remove(trimmed_filter_file)  # deletes the trimmed_filter_file after it is finished to keep folder tidy
-
-
-
+def read_gene_ids(path):  # returns the set of gene IDs listed in a file; the ID is the first column of every line
+    # path may be an input file (gene ID and K number), a plain list of gene IDs, either one compressed with gzip, or
+    # "-" to read standard input. The file is read once, line by line
+    if path == "-":
+        return gene_id_set(sys.stdin)
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"  # gzip files start with these two bytes, whatever their extension
+    with (gzip.open(path, "rt") if compressed else open(path, "r")) as f:
+        return gene_id_set(f)
+
+def gene_id_set(lines):  # returns the set of the first column of every line that is not blank
+    gene_ids = set()
+    for line in lines:
+        columns = line.split(None, 1)
+        if columns:
+            gene_ids.add(columns[0])
+    return gene_ids
+
+def gene_id_positions(gene_view):  # returns {gene ID: [positions in gene_view.source of the genes with that ID]}
+    id_positions = {}
+    for position, gene in zip(gene_view.positions(), gene_view):
+        id_positions.setdefault(gene.gene_num, []).append(position)
+    return id_positions
+
+def take_subset(filter_file, id_positions = None):  # keeps only the genes whose gene ID is listed in filter_file (see read_gene_ids())
+    # returns the number of gene IDs of filter_file that were found in _gene_list and the number that were not.
+    # id_positions may be the gene_id_positions() of _gene_list, so that no gene has to be read to find the subset
+    try:
+        filter_ids = read_gene_ids(filter_file)  # set of geneIDs to filter the data by
+    except FileNotFoundError:  # if the computer cannot find the path the user specified
+        sys.exit("No input file found at " + filter_file)  # exit the program with error message
+    if id_positions is None:
+        apply_filter(_gene_list.filter(lambda gene: gene.gene_num in filter_ids), "gene IDs in " + filter_file)
+        matched = len({gene.gene_num for gene in _gene_list})  # a gene ID can appear more than once in the data
+    else:
+        found = [gene_id for gene_id in filter_ids if gene_id in id_positions]
+        positions = sorted(position for gene_id in found for position in id_positions[gene_id])  # keeps the gene order
+        apply_filter(Gene_View(_gene_list.source, positions), "gene IDs in " + filter_file)
+        matched = len(found)
+    print(str(matched) + " of " + str(len(filter_ids)) + " gene IDs in the filter file matched, " +
+          str(len(filter_ids) - matched) + " were not found")
+    return matched, len(filter_ids) - matched
+
+############ Filter Index ############
+_query_fields = ("name", "definition", "pathway")  # fields a filter expression can search
+_query_pattern = re.compile(r'\(|\)|"[^"]*"?|[^\s()"]+')  # splits a filter expression into parentheses, "quotes" and words
+
+def parse_query(expression):  # parses a filter expression into a tree that Filter_Index.query() can answer
+    # expression syntax, from lowest to highest precedence:
+    #   a OR b      genes matching either side
+    #   a AND b     genes matching both sides; "a b" is also read as "a AND b"
+    #   NOT a       genes not matching a
+    #   (a)         groups an expression
+    #   text        genes whose name, definition or a pathway name contains text, ignoring case (like the filter menus)
+    #   field:text  only searches one field: name, definition or pathway
+    #   field=text  genes with text as a whole word of the field (ex. name=ATP1 does not match ATP1A)
+    # text can be put in double quotes to include spaces or the words AND, OR and NOT
+    # returns nested tuples: ("or", a, b), ("and", a, b), ("not", a), ("contains" or "term", field or None, text)
+    tokens = _query_pattern.findall(expression)
+    position = [0]  # position of the next token; a list so the nested functions can change it
+
+    def peek():
+        return tokens[position[0]] if position[0] < len(tokens) else None
+
+    def take():
+        position[0] += 1
+        return tokens[position[0] - 1]
+
+    def parse_or():
+        node = parse_and()
+        while peek() == "OR":
+            take()
+            node = ("or", node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() not in (None, ")", "OR"):
+            if peek() == "AND":
+                take()
+            node = ("and", node, parse_not())
+        return node
+
+    def parse_not():
+        if peek() == "NOT":
+            take()
+            return ("not", parse_not())
+        return parse_term()
+
+    def parse_term():
+        token = peek()
+        if token is None:
+            raise ValueError("expression ends where a search term was expected")
+        if token in ("AND", "OR", ")"):
+            raise ValueError("a search term was expected before " + token)
+        take()
+        if token == "(":
+            node = parse_or()
+            if peek() != ")":
+                raise ValueError("missing )")
+            take()
+            return node
+        field = None
+        kind = "contains"
+        match = re.match(r"(\w+)([:=])(.*)$", token)
+        if match and match.group(1).lower() in _query_fields:  # field:text or field=text
+            field = match.group(1).lower()
+            kind = "contains" if match.group(2) == ":" else "term"
+            token = match.group(3)
+            if not token:  # the text follows as its own token, ex. definition:"protein kinase"
+                if peek() is None or peek() in ("(", ")"):
+                    raise ValueError("missing search text after " + field + match.group(2))
+                token = take()
+        if token.startswith('"'):
+            if len(token) < 2 or not token.endswith('"'):
+                raise ValueError("missing closing quote")
+            token = token[1:-1]
+        return (kind, field, token)
+
+    if not tokens:
+        raise ValueError("empty expression")
+    tree = parse_or()
+    if peek() is not None:
+        raise ValueError("unexpected " + peek())
+    return tree
+
+class Filter_Index:  # token and trigram index over the names, definitions and pathway names of every gene in source
+    # every distinct text is indexed once along with the positions in source of the genes that have it, so a search
+    # only looks at the few texts whose trigrams match instead of at every gene. Searches give exactly the genes
+    # Gene.check_name(), check_definition() and check_pathway() would keep
+    def __init__(self, source, pathway_index):
+        self.source = source  # sequence of genes the positions refer to (ex. the source of a Gene_View)
+        self.size = len(source)
+        self.texts = {field: [] for field in _query_fields}  # lower case distinct texts of each field
+        self.genes = {field: [] for field in _query_fields}  # positions of the genes having each text
+        self.trigrams = {field: {} for field in _query_fields}  # {trigram: set of text numbers}
+        self.tokens = {field: {} for field in _query_fields}  # {word: set of text numbers}
+        numbers = {field: {} for field in _query_fields}  # {text: text number}
+        for position, gene in enumerate(source):
+            for field, texts in (("name", (gene.name,)), ("definition", (gene.definition,)),
+                                 ("pathway", [pathway_index[m_code].name for m_code in gene.link_path])):
+                for text in texts:
+                    number = numbers[field].get(text)
+                    if number is None:
+                        number = numbers[field][text] = self.add_text(field, text)
+                    self.genes[field][number].append(position)
+
+    def add_text(self, field, text):  # indexes a new distinct text and returns its number
+        number = len(self.texts[field])
+        text = text.lower()
+        self.texts[field].append(text)
+        self.genes[field].append([])
+        for i in range(len(text) - 2):
+            self.trigrams[field].setdefault(text[i:i + 3], set()).add(number)
+        for word in re.findall(r"\w+", text):
+            self.tokens[field].setdefault(word, set()).add(number)
+        return number
+
+    def matching_texts(self, field, target, kind = "contains"):  # numbers of the texts of field that match target
+        target = target.lower()
+        if kind == "term":
+            return self.tokens[field].get(target, set())
+        if len(target) < 3:  # too short to have a trigram, so every text is tested
+            return {number for number, text in enumerate(self.texts[field]) if target in text}
+        candidates = None
+        for i in range(len(target) - 2):  # texts containing target contain each of its trigrams
+            texts = self.trigrams[field].get(target[i:i + 3])
+            if not texts:
+                return set()
+            candidates = set(texts) if candidates is None else candidates & texts
+        texts = self.texts[field]
+        return {number for number in candidates if target in texts[number]}  # trigrams can match in another order
+
+    def search(self, field, target, kind = "contains"):  # returns the set of positions of the genes matching target
+        # field None searches the name, definition and pathways
+        positions = set()
+        for search_field in (_query_fields if field is None else (field,)):
+            genes = self.genes[search_field]
+            for number in self.matching_texts(search_field, target, kind):
+                positions.update(genes[number])
+        return positions
+
+    def query(self, expression):  # returns the set of positions of the genes matching a filter expression
+        return self.evaluate(parse_query(expression) if isinstance(expression, str) else expression)
+
+    def evaluate(self, tree):  # evaluates a tree returned by parse_query()
+        if tree[0] == "or":
+            return self.evaluate(tree[1]) | self.evaluate(tree[2])
+        if tree[0] == "and":
+            return self.evaluate(tree[1]) & self.evaluate(tree[2])
+        if tree[0] == "not":
+            return set(range(self.size)) - self.evaluate(tree[1])
+        return self.search(tree[1], tree[2], tree[0])
+
+def open_filter_index():  # returns the Filter_Index of the genes loaded from the data file, building it when needed
+    global _filter_index
+    source = _gene_list.source
+    if _filter_index is None or _filter_index.source is not source:  # built once per data file loaded
+        _filter_index = Filter_Index(source, _pathway_index)
+    return _filter_index
+
+def filter_genes(field, target, kind = "contains"):  # keeps only the genes of _gene_list matching target in field
+    apply_filter(_gene_list.select(open_filter_index().search(field, target, kind)),
+                 (field or "name, definition or pathway") + (" contains " if kind == "contains" else " has the word ") +
+                 '"' + target + '"')
+
+def filter_genes_by_query(expression):  # keeps only the genes of _gene_list matching a filter expression
+    # raises ValueError if the expression is not valid
+    apply_filter(_gene_list.select(open_filter_index().query(expression)), expression)
+
+############ Filter Stack ############
+def apply_filter(gene_view, description):  # makes gene_view the filtered _gene_list; the one it replaces is kept
+    global _gene_list
+    _filter_stack.append((description, _gene_list))
+    _gene_list = gene_view
+
+def restore_filters(depth = 0):  # keeps only the first depth filters that were applied; 0 removes every filter
+    # the genes are never read again from the data file, the _gene_list from before the removed filters is restored
+    global _gene_list
+    if len(_filter_stack) > depth:
+        _gene_list = _filter_stack[depth][1]
+        del _filter_stack[depth:]
+
+def undo_filter():  # removes the last filter applied and returns its description, or None if there was none
+    if not _filter_stack:
+        return None
+    description = _filter_stack[-1][0]
+    restore_filters(len(_filter_stack) - 1)
+    return description
+
+def filter_descriptions():  # returns the description of every filter applied, in order
+    return [description for description, gene_view in _filter_stack]
+
+def filtered_pathways():  # returns the pathways of _pathway_list that are linked to at least one gene of _gene_list
+    # computed the first time it is needed after the genes were filtered, then reused until _gene_list changes
+    global _filtered_pathways
+    if len(_gene_list) == _total_genes:  # no gene was filtered out, so every pathway is still linked to a gene
+        return _pathway_list
+    if _filtered_pathways is None or _filtered_pathways[0] is not _gene_list:
+        incidence = open_incidence()
+        if isinstance(_gene_list, Gene_View) and _gene_list.source is incidence.source:
+            k_mask = incidence.gene_k_mask(_gene_list.positions())
+        else:  # ex. a list of genes set by a script
+            k_mask = incidence.k_mask([gene.k_code for gene in _gene_list])
+        counts = incidence.pathway_counts(k_mask)  # number of k codes of the genes in every pathway at once
+        _filtered_pathways = (_gene_list, [pathway for pathway in _pathway_list
+                                           if counts[incidence.pathway_numbers[pathway.map_code]]])
+    return _filtered_pathways[1]
+
+
+############ Pathway Incidence ############
+class Pathway_Incidence:  # sparse incidence of genes, k codes and pathways in compressed sparse row (CSR) form
+    # k codes are numbered in k code order. Each gene position in source is linked to its k number by gene_k, and the
+    # k numbers of pathway p are pathway_k[pathway_start[p]:pathway_start[p + 1]]. A subset of genes is given as a mask
+    # over the k numbers, so the counts and coverage of every pathway are computed at once. When numpy is installed
+    # the arrays are numpy arrays and the operations are vectorized; otherwise plain lists are used
+    def __init__(self, pathways, gene_k_codes = (), source = None):
+        self.source = source  # sequence of genes that gene positions refer to, if any
+        self.pathways = list(pathways)  # pathway number -> Pathway_MAP
+        self.pathway_numbers = {pathway.map_code: number for number, pathway in enumerate(self.pathways)}
+        gene_k_codes = list(gene_k_codes)
+        k_codes = set(gene_k_codes)
+        for pathway in self.pathways:
+            k_codes.update(pathway.genes_set)
+        self.k_codes = sorted(k_codes)  # k number -> k code
+        self.k_numbers = {k_code: number for number, k_code in enumerate(self.k_codes)}
+        pathway_start = [0]
+        pathway_k = []
+        for pathway in self.pathways:
+            pathway_k.extend(sorted([self.k_numbers[k_code] for k_code in pathway.genes_set]))
+            pathway_start.append(len(pathway_k))
+        gene_k = [self.k_numbers[k_code] for k_code in gene_k_codes]
+        if numpy is not None:
+            self.pathway_start = numpy.array(pathway_start, dtype=numpy.int64)
+            self.pathway_k = numpy.array(pathway_k, dtype=numpy.int64)
+            self.gene_k = numpy.array(gene_k, dtype=numpy.int64)
+            self.sizes = numpy.diff(self.pathway_start)  # number of k codes of each pathway
+            # pathway number of every entry of pathway_k
+            self.entry_pathway = numpy.repeat(numpy.arange(len(self.pathways), dtype=numpy.int64), self.sizes)
+        else:
+            self.pathway_start = pathway_start
+            self.pathway_k = pathway_k
+            self.gene_k = gene_k
+            self.sizes = [pathway_start[p + 1] - pathway_start[p] for p in range(len(self.pathways))]
+
+    def k_mask(self, k_codes):  # returns the mask of the k numbers of k_codes; unknown k codes are ignored
+        numbers = [self.k_numbers[k_code] for k_code in k_codes if k_code in self.k_numbers]
+        if numpy is not None:
+            mask = numpy.zeros(len(self.k_codes), dtype=bool)
+            mask[numpy.array(numbers, dtype=numpy.int64)] = True
+            return mask
+        mask = [False] * len(self.k_codes)
+        for number in numbers:
+            mask[number] = True
+        return mask
+
+    def gene_k_mask(self, positions):  # returns the mask of the k numbers of the genes at positions in source
+        if numpy is not None:
+            mask = numpy.zeros(len(self.k_codes), dtype=bool)
+            mask[self.gene_k[numpy.fromiter(positions, dtype=numpy.int64)]] = True
+            return mask
+        mask = [False] * len(self.k_codes)
+        gene_k = self.gene_k
+        for position in positions:
+            mask[gene_k[position]] = True
+        return mask
+
+    def pathway_counts(self, k_mask):  # returns the number of k codes of each pathway that are in k_mask
+        if numpy is not None:
+            return numpy.bincount(self.entry_pathway[k_mask[self.pathway_k]], minlength=len(self.pathways))
+        pathway_k = self.pathway_k
+        start = self.pathway_start
+        return [sum([k_mask[k] for k in pathway_k[start[p]:start[p + 1]]]) for p in range(len(self.pathways))]
+
+    def coverage(self, k_mask):  # returns the percentage of the k codes of each pathway that are in k_mask
+        counts = self.pathway_counts(k_mask)
+        if numpy is not None:
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                return numpy.where(self.sizes > 0, counts / self.sizes * 100, 0.0)
+        return [count / size * 100 if size else 0.0 for count, size in zip(counts, self.sizes)]
+
+    def pathway_k_codes(self, number, k_mask):  # returns the k codes of pathway number that are in k_mask, in order
+        start = self.pathway_start[number]
+        end = self.pathway_start[number + 1]
+        return [self.k_codes[k] for k in self.pathway_k[start:end] if k_mask[k]]
+
+def open_incidence():  # returns the Pathway_Incidence of the genes and pathways loaded from the data file
+    global _incidence
+    source = _gene_list.source
+    if _incidence is None or _incidence.source is not source:  # built once per data file loaded
+        _incidence = Pathway_Incidence(_pathway_index.values(), [gene.k_code for gene in source], source)
+    return _incidence
+
+
+
+def parse_ko_entry(entry, format_pathway_info = None):  # parses the text of one KO entry from KEGG's "get" site
+    # returns [NAME, DEFINITION, [map_code map_name, map_code map_name, ...]]; missing fields are left empty
+    name = ''  # SYMBOL field of the entry
+    definition = ''  # NAME field of the entry
+    linkPathList = []  # list to store pathways the gene is involved in [map_code map_name, ...]
+    for line in entry.splitlines():  # splits string by line
+        if not linkPathList:  # pythonic way to check if code reached pathway yet, if it has then go to else
+            column = line.split(None, 1)  # split line only once at first space to create two columns
+            if len(column) < 2:  # skips blank lines and fields without a value
+                continue
+            if column[0] == 'SYMBOL':  # checks first column to see if it is a name by checking first column
+                # ex line: SYMBOL ITPR1
+                name = column[1]
+            if column[0] == 'NAME':  # checks first column to see if it is a definition by checking first column
+                # ex line: NAME inositol 1,4,5-tripohsphate receptor type 1
+                definition = column[1]
+            if column[0] == 'PATHWAY':  # checks first column to see if list of pathways is starting by checking first column
+                # ex line: Pathway map04020 Calcium signaling pathway
+                linkPathList.append(column[1])  # adds pathway info to linkPathList
+        else:  # if started adding linked pathways, just keep with the chug and plug
+            line = line.lstrip()  # strips all the blank spaces from the beginning of the line
+            if line.startswith("map"):  # checks if first characters is 'map' to comfirm still on pathway
+                linkPathList.append(line)  # adds pathway info in linkPathList
+                # ex line: map00010  Glycolysis / Gluconeogenesis
+            else:  # after all pathways are added
+                break  # break out of for loop because there is no reason to keep checking file
+    if format_pathway_info is not None:  # lets callers reformat each pathway line
+        linkPathList = [format_pathway_info(path_info) for path_info in linkPathList]
+    return [name, definition, linkPathList]
+
+def fetch_ko_info(k_code, format_pathway_info = None):  # retrieves and parses one KO entry from KEGG
+    link = _kegg_rest_url + '/get/' + k_code  # creates link to get info on gene
+    try:
+        info_url = decode_url(link)  # access KEGG for information
+    except urllib.error.HTTPError as error:
+        if error.code == 404:  # KEGG has no entry for this k code
+            return ['', '', []]
+        raise  # any other HTTP error may go away on a rerun, so it is left to the caller
+    return parse_ko_entry(info_url, format_pathway_info)
 
+def fetch_ko_batch(k_codes):  # retrieves several KO entries with one request ('get/K00001+K00002+...')
+    # returns {k_code: [NAME, DEFINITION, [pathways]]}; k codes KEGG has no entry for get ['', '', []], which
+    # is only assumed for a 404 on a single k code because one bad k code can make KEGG reject a whole batch
+    link = _kegg_rest_url + '/get/' + '+'.join(k_codes)
+    try:
+        info_url = decode_url(link)  # access KEGG for information
+    except urllib.error.HTTPError as error:
+        if error.code == 404 and len(k_codes) == 1:  # KEGG has no entry for the k code
+            return {k_codes[0]: ['', '', []]}
+        raise  # a failed batch is left to the caller, which requests its k codes again one at a time
+    entries = {}  # {ENTRY id: parsed entry}
+    entry_lines = []  # lines of the entry currently being read
+    for line in info_url.splitlines():
+        if line.startswith('///'):  # every entry ends with a line of '///'
+            entry_id = entry_lines[0].split()[1] if entry_lines and entry_lines[0].startswith('ENTRY') else None
+            if entry_id is not None:  # ex line: ENTRY       K00001                      KO
+                entries[entry_id.upper()] = parse_ko_entry("\n".join(entry_lines))
+            entry_lines = []
+        else:
+            entry_lines.append(line)
+    return {k_code: entries.get(k_code.upper(), ['', '', []]) for k_code in k_codes}
+
+def fetch_k_codes(k_codes, workers = None, batch_size = None):  # fetches KO entries with a bounded pool of worker threads
+    # yields (k_code, info_list, error) in the same order as k_codes; error is None unless the request failed, so
+    # one failed request never stops the others
+    if workers is None:  # if no limit is specified, use the global limit
+        workers = _fetch_workers
+    if batch_size is None:  # if no batch size is specified, use the global batch size
+        batch_size = _kegg_batch_size
+    k_codes = list(k_codes)
+    batches = [k_codes[i:i + batch_size] for i in range(0, len(k_codes), batch_size)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(fetch_ko_batch, batch) for batch in batches]  # every batch is queued at once
+        for batch, future in zip(batches, futures):  # waits for the results in order
+            try:
+                batch_info = future.result()
+            except Exception as error:  # ex. HTTPError, URLError, ConnectionResetError, TimeoutError
+                for k_code in batch:  # every k code of a failed request gets the same error
+                    yield k_code, None, error
+                continue
+            for k_code in batch:
+                yield k_code, batch_info[k_code], None
+
+def resolve_k_codes(k_codes, workers = None):  # resolves every distinct k code exactly once
+    # returns ({k_code: [NAME, DEFINITION, [pathways]]}, {k_code: error}) where the second dict holds the k codes
+    # that could not be retrieved
+    k_codes = list(dict.fromkeys(k_codes))  # removes duplicates while keeping the order of the k codes
+    offline_index = open_offline_index()
+    if offline_index is not None:  # in offline mode every k code is looked up in the local index
+        return offline_index.get_many(k_codes), {}
+    resolved = {k_code: _shared_k_codes[k_code] for k_code in k_codes if k_code in _shared_k_codes}  # see prefetch_batch_k_codes()
+    k_codes = [k_code for k_code in k_codes if k_code not in resolved]
+    ko_cache = open_ko_cache()
+    if ko_cache is not None:
+        resolved.update(ko_cache.get_many(k_codes))  # k codes annotated by a previous run
+    failed = {}  # k codes that could not be retrieved and the error that was raised
+    fetched = {}  # k codes retrieved from KEGG that still need to be written to the cache
+    missing = [k_code for k_code in k_codes if k_code not in resolved]
+    try:
+        for deferred_round in range(_deferred_rounds + 1):  # k codes that failed are deferred to the next round
+            if deferred_round > 0 and missing:
+                print("Retrying " + str(len(missing)) + " K-codes that could not be retrieved")
+            failed = {}
+            # deferred k codes are requested one at a time, so a single bad k code cannot fail a whole batch again
+            for k_code, info_list, error in fetch_k_codes(missing, workers, 1 if deferred_round > 0 else None):
+                if error is not None:  # ex. a 400 or 403 for the batch; a 404 for a single k code is not an error
+                    failed[k_code] = error
+                    continue
+                resolved[k_code] = fetched[k_code] = info_list
+                if ko_cache is not None and len(fetched) >= 100:  # writes progress to the cache every 100 k codes
+                    ko_cache.put_many(fetched)
+                    fetched = {}
+            missing = list(failed)
+            if not missing:
+                break
+    finally:  # k codes fetched before an interruption are kept for the next run
+        if ko_cache is not None and fetched:
+            ko_cache.put_many(fetched)
+    return resolved, failed
 
 class Pathway_MAP:  # class for pathway map objects
+    __slots__ = ("map_code", "name", "genes_set", "genes_sorted", "url")  # no per object __dict__ is needed
+
     def __init__(self, ipathway_info):  # accepts the map code of the pathway
         pathway_info = ipathway_info.split(None, 1)  # separtes the map code and the map name by spiting at first space
-        self.map_code = pathway_info[0]  # stores map code in map_code
-        self.name = pathway_info[1]  # stores name into the 'name' variable
-        self.genes_invol = []  # creates an empty list that will store all the genes involved in the pathway
+        self.map_code = sys.intern(pathway_info[0])  # stores map code in map_code, shared with the genes' link_path
+        self.name = pathway_info[1] if len(pathway_info) > 1 else ""  # stores name into the 'name' variable, if any
+        self.genes_set = set()  # creates an empty set that will store the k codes of all the genes involved in the pathway
+        self.genes_sorted = None  # sorted list of genes_set; built when needed and discarded when genes_set changes
         self.url = ""  # base url or pathway map with genes highlighted
 
+    @property
+    def genes_invol(self):  # the k codes of the genes involved in the pathway, ordered by k_code
+        if self.genes_sorted is None:  # only sorts again after genes were added
+            self.genes_sorted = sorted(self.genes_set)
+        return self.genes_sorted
+
+    @genes_invol.setter
+    def genes_invol(self, k_codes):
+        self.genes_set = set(k_codes)
+        self.genes_sorted = None
+
+    def __getstate__(self):  # the sorted list is not saved since it can be rebuilt from genes_set
+        return self.map_code, self.name, self.genes_set, self.url
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # pathway saved by an older version of GAEV, which stores a genes_invol list
+            state = (state["map_code"], state["name"], state["genes_invol"], state.get("url", ""))
+        map_code, self.name, genes_set, self.url = state
+        self.map_code = sys.intern(map_code)
+        self.genes_set = {sys.intern(k_code) for k_code in genes_set}  # k codes are shared with the genes
+        self.genes_sorted = None
+
     def add_gene(self, ik_code):
-        bisect.insort(self.genes_invol, ik_code)  # add a gene to pathway and keeps gene ordered by k_code
-        self.genes_invol = list(set(self.genes_invol))
+        if ik_code not in self.genes_set:  # adding a gene already in the pathway changes nothing
+            self.genes_set.add(ik_code)  # add a gene to pathway
+            self.genes_sorted = None  # genes_invol will be sorted again when it is next used
 
     def generate_url(self, ik_code):  # generates base url from ko code of pathway and k code of genes involved and selected gene
-        self.url = "http://www.kegg.jp/kegg-bin/show_pathway?map=" + self.map_code + "&multi_query="  # sets the which pathway to use
-        for k_code in self.genes_invol:  # goes through each gene in genes_invol
-            self.url = self.url + k_code + "+%23bfffbf%0d%0a"  # adds gene's k_code to the end of the url and specifies color
-        self.url = self.url + ik_code + "+%238B0000,%23F0F8FF"  # adds the selected gene and marks it with a different color
+        self.url = "http://www.kegg.jp/kegg-bin/show_pathway?map=" + self.map_code + "&multi_query=" + \
+                   "".join([k_code + "+%23bfffbf%0d%0a" for k_code in self.genes_invol]) + \
+                   ik_code + "+%238B0000,%23F0F8FF"  # adds every gene, then marks the selected gene with a different color
         return self.url
 
     def check_genes(self, gene_list):  # checks if any associated genes is in the current filtered gene list
-        k_code = [gene.k_code for gene in gene_list]  # extracts k-codes from list of gene objects into their own list
-        is_there = bool(set(self.genes_invol) & set(k_code))  # tests for common items between genes_invol and k_code
+        # to check every pathway against a gene list at once, use Pathway_Incidence.pathway_counts() instead
+        is_there = not self.genes_set.isdisjoint(gene.k_code for gene in gene_list)  # tests for common k codes
         return is_there
 
     def __eq__(self, other):  # overrides the implementation of the equal operator
@@ -162,48 +1186,53 @@ class Pathway_MAP:  # class for pathway map objects
         return False  # if the other object is not a Pathway_MAP object, then return FALSE
 
 class Gene:  # class for gene objects
-    def __init__(self,ig_num, ik_code):  # accepts the gene number and the KEGG's k code for the gene
+    # genes are the most numerous objects, so they have no per object __dict__ and share their k code and map code strings
+    __slots__ = ("gene_num", "k_code", "name", "definition", "link_path", "log2foldchange")
+
+    def __init__(self,ig_num, ik_code, info_list = None):  # accepts the gene number and the KEGG's k code for the gene
         self.gene_num = ig_num  # sets gene number
-        self.k_code = ik_code  # sets k number
-        infoList = self.get_info()  # runs get_info() to retrieve information on gene from KEGG
+        self.k_code = sys.intern(ik_code)  # sets k number
+        if info_list is None:  # if the k code was not already resolved by resolve_k_codes(),
+            info_list = self.get_info()  # runs get_info() to retrieve information on gene from KEGG
+        infoList = info_list
         self.name = infoList[0]  # sets gene name
         self.definition = infoList[1]  # sets gene definition
-        self.link_path = infoList[2]  # sets pathways that gene is involved in [map_code, map_name, map_code, map_name ...]
+        # sets pathways that gene is involved in (map_code, map_code, ...); the map names are kept by the Pathway_MAP objects
+        self.link_path = pathway_codes(infoList[2])
         self.log2foldchange = 0.0  # sets variable to be used in differential expression analysis
 
+    def __getstate__(self):
+        return self.gene_num, self.k_code, self.name, self.definition, self.link_path, self.log2foldchange
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # gene saved by an older version of GAEV, where link_path holds 'map_code map_name'
+            state = (state["gene_num"], state["k_code"], state["name"], state["definition"], state["link_path"],
+                     state.get("log2foldchange", 0.0))
+        self.gene_num, k_code, self.name, self.definition, link_path, self.log2foldchange = state
+        self.k_code = sys.intern(k_code)  # unpickled strings are separate copies, so they are shared again
+        self.link_path = pathway_codes(link_path)
+        if self.log2foldchange == 0.0:  # unpickled floats are separate objects too; most genes share the default 0.0
+            self.log2foldchange = 0.0
+
     def format_pathway_info(self, ipathway_info):  # accepts line from gene's "get" site from KEGG
         # ipathway_info = "map" + ipathway_info[2:]  # line removed  since KEGG updated prefix to be 'map' instead of 'ko'
         return ipathway_info
 
     def get_info(self):  # accepts a k code and returns a list with name first then description then associated map codes
-        infoList = []  # empty list to store gene name and description and pathways the gene is involved in
         # ex list: [NAME, DEFINITION, [map_code map_name, map_code map_name, map_code map_name, ...]]
-        linkPathList = []  # list to store pathways the gene is involved in [map_code map_name, ...]
-        link = 'http://rest.kegg.jp/get/' + self.k_code  # creates link to get info on gene
-        try:
-            info_url = decode_url(link)  # access KEGG for information
-        except urllib.error.HTTPError as error:
-            return ['', '', []]
-        for line in info_url.splitlines():  # splits string by line
-            if not linkPathList:  # pythonic way to check if code reached pathway yet, if it has then go to else
-                column = line.split(None, 1)  # split line only once at first space to create two columns
-                if column[0] == 'SYMBOL':  # checks first column to see if it is a name by checking first column
-                    # ex line: SYMBOL ITPR1
-                    infoList.append(column[1])  # adds second column (actual name) to infoList; always first
-                if column[0] == 'NAME':  # checks first column to see if it is a definition by checking first column
-                    # ex line: NAME inositol 1,4,5-tripohsphate receptor type 1
-                    infoList.append(column[1])  # adds second column (definition) to infoList; always second
-                if column[0] == 'PATHWAY':  # checks first column to see if list of pathways is starting by checking first column
-                    # ex line: Pathway map04020 Calcium signaling pathway
-                    linkPathList.append(self.format_pathway_info(column[1]))  # adds formatted pathway info to linkPathList
-            else:  # if started adding linked pathways, just keep with the chug and plug
-                line = line.lstrip()  # strips all the blank spaces from the beginning of the line
-                if line.startswith("map"):  # checks if first characters is 'map' to comfirm still on pathway
-                    linkPathList.append(self.format_pathway_info(line))  # adds formatted pathway info in linkPathList
-                    # ex line: map00010  Glycolysis / Gluconeogenesis
-                else:  # after all pathways are added
-                    break  # break out of for loop because there is no reason to keep checking file
-        infoList.append(linkPathList)  # add linkPathList to infoList
+        offline_index = open_offline_index()
+        if offline_index is not None:  # in offline mode the k code is looked up in the local index
+            return offline_index.get_many([self.k_code])[self.k_code]
+        ko_cache = open_ko_cache()  # checks the persistent KO cache before accessing KEGG
+        if ko_cache is not None:
+            infoList = ko_cache.get(self.k_code)
+            if infoList is not None:
+                return infoList
+        # access KEGG for information; a k code KEGG has no entry for gets ['', '', []], while any other error is raised
+        # once the retries ran out, so it is never saved as a blank gene
+        infoList = fetch_ko_info(self.k_code, self.format_pathway_info)
+        if ko_cache is not None:
+            ko_cache.put(self.k_code, infoList)
         return infoList  # finally return infoList [NAME, DEFINITION, [map_code map_name, map_code map_name, ...]]
 
     # searches name to check if target term is in the name
@@ -223,12 +1252,12 @@ class Gene:  # class for gene objects
         return is_there
 
     #  searches linked pathways to see if it includes the target term
-    def check_pathway(self, target, pathway_list):
+    def check_pathway(self, target, pathway_index):  # pathway_index is the registry of pathways by map code
+        if isinstance(pathway_index, list):  # also accepts a plain list of pathways
+            pathway_index = index_pathways(pathway_index)
         is_there = False  # boolean to check if target term is in linked pathways
         for m_code in self.link_path:  # cycles through every linked pathway in gene
-            # each element in link_path is ['map_code map_name'], so m_code needs to be split from name
-            pathway = next(temp_pathway for temp_pathway in pathway_list if
-                           temp_pathway.map_code == m_code.split(' ',1)[0])  # finds pathway that matches map code
+            pathway = pathway_index[m_code]  # finds pathway that matches map code
             pathway_name = pathway.name  # stores name of pathway into variable pathway_name
             if target.lower() in pathway_name.lower():  # checks if pathway name matches target name
                     is_there = True
@@ -243,9 +1272,9 @@ def trim_unannotated(path = None):
 
     if path == None:  # if no path is passed to the function
         path = _input_file  # then use the input file path that was previously stored
-    else:  # if the input path was set (different from _input_file path); only used when input file is used as filter
-        # creates a path to the temporary trimmed input file that will be used for filtering; different from the...
-        # trimmed file path (_trimmed_file) that is used for generating the data file
+    else:  # if the input path was set (different from _input_file path)
+        # creates a path to a trimmed copy of another input file; different from the trimmed file path (_trimmed_file)
+        # that is used for generating the data file
         abs_path = os.path.abspath(path)  # handles distinction between relative and abs path by converting all to abs path
         file_dir = os.path.dirname(abs_path)  # obtains the path to the directory the file is in
         file_name, file_no_ext = get_file_name(abs_path)  # gets file name (w/ and w/o ext) without the directory  path
@@ -278,67 +1307,143 @@ def gen_pathway(trimmed_file = None, data_file = None):
         sys.exit("No trimmed input file found at " + trimmed_file)  # if it doesn't exist,exit the program with msg
 
     pathwayList = []  # creates an empty list to store all the pathways the annotated genes are involved in
-    geneList = []  # creates an empty list to store all the annotated genes and their linked pathways
+    pathway_index = {}  # registry of the pathways in pathwayList by map code
+    # creates an empty list to store all the annotated genes and their linked pathways in input order; a gene whose
+    # k code could not be retrieved is held by a placeholder ("unresolved", gene_number, k_code) until a rerun
+    geneList = []
     completed = False  # records whether program has run to completion or not.
     num_already_saved = 0  # records number of gene entries already on saved file
-    resume_check_link_path = True  # when resuming, makes sure every gene is added to every pathway map before moving on
+    # every gene is appended to the journal as soon as it is created; the data file is only written once at the end
+    journal_file = data_file + ".journal"
 
     n = 0  # integer to track which gene the code is on
 
     try:  # trys to open data file
-        with open(data_file, "rb") as f:
-            if pickle.load(f):  # checks if the data is complete or not
-                os.remove(trimmed_file)  # delete the trimmed_file after using it to keep the folder tidy
-                sys.exit("A completed data file for " + data_name + " dataset already exist. Please rename or delete " + data_name + " if you wish to work with a rerun dataset.")  # if data is already complete, do not run rest of code
-            else:  # if data is not complete, load the data
-                num_already_saved = pickle.load(f)  # record where the data left off at
-                for _ in range(num_already_saved):  # loads all gene data into geneList
-                    geneList.append(pickle.load(f))
-                for _ in range(pickle.load(f)):  # loads all pathway data into pathwayList
-                    pathwayList.append(pickle.load(f))
+        header = read_data_header(data_file)
+        unresolved = header["provenance"].get("unresolved")  # [[position, gene_number, k_code], ...] of a previous run
+        if header["completed"] and not unresolved:  # checks if the data is complete or not
+            os.remove(trimmed_file)  # delete the trimmed_file after using it to keep the folder tidy
+            sys.exit("A completed data file for " + data_name + " dataset already exist. Please rename or delete " + data_name + " if you wish to work with a rerun dataset.")  # if data is already complete, do not run rest of code
+        elif not os.path.isfile(journal_file):  # incomplete data file, or genes whose k code could not be retrieved
+            geneList.extend(read_data_genes(data_file, header))  # loads all gene data into geneList
+            pathwayList.extend(read_data_pathways(data_file, header))
+            for position, gene_number, k_code in unresolved or []:  # only these genes are tried again
+                geneList.insert(position, ("unresolved", gene_number, k_code))
     except IOError:
-        print("New " + data_name + " will be created.")
+        if not os.path.isfile(journal_file):
+            print("New " + data_name + " will be created.")
+
+    if os.path.isfile(journal_file):  # resumes by replaying the genes recorded in the journal
+        geneList, pathwayList, offset = read_journal(journal_file)
+        journal = open(journal_file, "r+b")
+        journal.truncate(offset)  # removes a record that was cut short by a crash
+        journal.seek(offset)
+        if offset == 0:  # the journal did not even have a complete header
+            pickle.dump(_journal_header, journal)
+        print("Resuming " + data_name + " from " + str(len(geneList)) + " genes saved in " + os.path.basename(journal_file))
+    else:  # starts a new journal, which also holds the genes of an older incomplete data file
+        journal = open(journal_file, "wb")
+        pickle.dump(_journal_header, journal)
+        for record in pathwayList + geneList:
+            pickle.dump(record, journal)
+    pathway_index.update(index_pathways(pathwayList))
+    for gene in geneList:  # rebuilds the pathways from the genes already saved
+        if isinstance(gene, Gene):
+            add_to_pathways(gene, pathwayList, pathway_index)
+    num_already_saved = len(geneList)
 
-    with open(trimmed_file, 'r') as annotated_genes: #opens the trimmed gene list file
-        for line in annotated_genes: #iterates through each line of the file
-            n = n+1  # for each line, n increases by one to represent it is working on the next code
+    try:
+        # phase one: collects the distinct k codes of the genes that still need to be added and resolves each one once
+        retry_genes = [record[1:] for record in geneList if not isinstance(record, Gene)]  # [gene_number, k_code]
+        new_genes = []  # stores [gene_number, k_code] of every gene that has not already been saved
+        with open(trimmed_file, 'r') as annotated_genes: #opens the trimmed gene list file
+            for line in annotated_genes: #iterates through each line of the file
+                n = n+1  # for each line, n increases by one to represent it is working on the next code
+                if n > num_already_saved:  # skips all genes that has already been saved
+                    currGene = line.split()  # isolates gene number from k_code
+                    new_genes.append(currGene[:2])
+        if retry_genes:
+            print("Retrying " + str(len(retry_genes)) + " genes whose K-codes could not be retrieved before")
+        k_codes = list(dict.fromkeys(k_code for gene_number, k_code in retry_genes + new_genes))  # distinct k codes in input order
+        print("Resolving " + str(len(k_codes)) + " unique K-codes for " + str(len(retry_genes) + len(new_genes)) +
+              " genes (" + str(len(retry_genes) + len(new_genes) - len(k_codes)) + " fetches saved)")
+        info_table, failed = resolve_k_codes(k_codes)  # {k_code: [NAME, DEFINITION, [pathways]]}, {k_code: error}
+        for k_code, error in list(failed.items())[:10]:  # reports the first few errors
+            print("Could not retrieve " + k_code + ": " + str(error))
+
+        # phase two: builds the gene and pathway objects from the resolved k codes without accessing KEGG
+        def add_gene(gene_number, k_code):  # creates the gene of a resolved k code and records it in the journal
+            if k_code in failed:  # a placeholder keeps the place of the gene, so the journal stays in input order
+                record = ("unresolved", gene_number, k_code)
+            else:
+                record = Gene(gene_number, k_code, info_table[k_code])  # creates a gene object
+                for pathway in add_to_pathways(record, pathwayList, pathway_index, info_table[k_code][2]):
+                    pickle.dump(pathway, journal)  # the journal keeps the map names, since genes only keep map codes
+            pickle.dump(record, journal)  # appends the gene to the journal
+            return record
+
+        if retry_genes:  # the journal is written again, with each retried gene in its place
+            journal.seek(0)
+            journal.truncate()
+            pickle.dump(_journal_header, journal)
+            for pathway in pathwayList:
+                pickle.dump(pathway, journal)
+            records = geneList
+            geneList = []
+            for record in records:
+                if isinstance(record, Gene):
+                    pickle.dump(record, journal)
+                else:
+                    record = add_gene(*record[1:])
+                geneList.append(record)
+        n = num_already_saved
+        for gene_number, k_code in new_genes:
+            n = n+1
             print(n)  # print out the number of the gene code is currently working on
-            if n > num_already_saved:  # skips all genes that has already been saved
-                currGene = line.split()  # isolates gene number from k_code
-                gene_number = currGene[0]
-                k_code = currGene[1]
-                try:
-                    geneList.append(Gene(gene_number, k_code))  # creates a gene object from k code and adds it to geneList
-                except (ConnectionResetError, TimeoutError) as error:  # if there is a ConnectionResetError or TimeoutError
-                    save(geneList, pathwayList, completed)  # save the data to a file
-                    sys.exit("Error encountered. Data successfully saved.")  # and exit the program with the following error message
-                for path_info in geneList[-1].link_path:  # runs for each pathway the gene was associated with
-                    m_code = path_info[:8]  # cuts the map code from the map code + map name of link_path element
-                    if any(x.map_code == m_code for x in pathwayList):  # checks to see if pathway was encountered before
-                        curr_pathway = next(x for x in pathwayList if x.map_code == m_code)  # finds pathway with that map_code and sets it as curr_pathway
-                        if resume_check_link_path:  # check if this is the first pass and need to check which  pathways the gene has already been added to
-                            if not any(x == k_code for x in curr_pathway.genes_invol):  # only execute the code directly below if gene hasn't already been added to pathway
-                                curr_pathway.add_gene(k_code) # adds gene to that pathway
-                        else:  # if this is not the first pass, just run the code directly below
-                            curr_pathway.add_gene(k_code)  # t adds gene to that pathway
-                    else:  # if this is the first time encountering this pathway
-                        try:
-                            pathwayList.append(Pathway_MAP(path_info))  # it creates a new pathway object
-                        except (ConnectionResetError, TimeoutError) as error:  # if there is a ConnectionResetError or TimeoutError
-                            geneList = geneList[:-1]  # deletes the last gene entry from geneList, so when the code restarts it will go through the map_code list of that gene again
-                            save(geneList,pathwayList, completed)  # save the data to a file
-                            sys.exit("Error encountered. Data successfully saved.")  # and exit the program with the following error maessage
-                        pathwayList[-1].add_gene(k_code)  # and adds the gene to the new pathway object
-                if n % 100 == 0:  # every 100 genes, run the code directly below
-                    save(geneList, pathwayList, completed)  # save the data to a file
-            resume_check_link_path = False  # no longer need to check if gene was already added to a pathway after first gene
+            geneList.append(add_gene(gene_number, k_code))  # adds the gene to geneList
+            if n % 100 == 0:  # every 100 genes, run the code directly below
+                journal.flush()
+                os.fsync(journal.fileno())  # makes sure the journal is on disk
+    finally:
+        journal.close()  # flushes every gene recorded so far, even when the run is interrupted
 
     completed = True  # if program reaches this step then it is completed
     os.remove(trimmed_file)  # delete the trimmed_file after using it to keep the folder tidy
-    save(geneList,pathwayList, completed)  # saves data to file
+    provenance = {"input_file": os.path.basename(_input_file), "kegg_source": _offline_index_file or _kegg_rest_url,
+                  "kegg_release": _kegg_release}
+    unresolved = [[position, record[1], record[2]] for position, record in enumerate(geneList)
+                  if not isinstance(record, Gene)]
+    if unresolved:  # a rerun tries only these genes again, see above
+        provenance["unresolved"] = unresolved
+        print(str(len(unresolved)) + " genes were left out because their K-codes could not be retrieved. "
+              "Run again to retry them.")
+    # compacts the journal into the data file
+    save([gene for gene in geneList if isinstance(gene, Gene)], pathwayList, completed, data_file, provenance)
+    os.remove(journal_file)  # the journal is no longer needed once the data file is complete
 
 ############ Generate Output File ############
-def out_HTML(data_file = None, html_file = None, gene_table = True, pathway_table = True):
+def open_output(output_file, mode = "w"):  # opens an output file that is written to in large buffered chunks
+    return open(output_file, mode, buffering=_html_buffer_size)
+
+def make_gene_table_rows(geneList, pathwayIndex):  # yields the html row of each gene of the gene table
+    pathway_links = {}  # {(k_code, link_path): hyperlinks}; genes with the same k code have the same pathway links
+    for gene in geneList:  # cycles through even gene; one gene each row
+        links = pathway_links.get((gene.k_code, gene.link_path))
+        if links is None:
+            hyperlinks = []
+            for m_code in gene.link_path:  # cycles through each map code for pathways linked to gene
+                pathway = pathwayIndex[m_code]  # finds pathway that matches map code
+                hyper_text = pathway.name + "(" + str(len(
+                    pathway.genes_invol)) + ")"  # generates the text for the hyperlink (name + num of associated genes)
+                url = pathway.generate_url(gene.k_code)  # generates the url
+                hyperlinks.append("<a href=\"" + url + "\">" + hyper_text + "</a>")  # embeds hyperlink to text
+            links = pathway_links[(gene.k_code, gene.link_path)] = ", ".join(hyperlinks)  # adds a ", " between hyperlinks
+        # adds the gene number, k number, and definition to first three columns, then the hyperlinks and end of row
+        yield "<tr><td>" + gene.gene_num + "</td><td>" + gene.name + "</td><td>" + gene.k_code + "</td><td>" \
+              + gene.definition + "</td><td>" + links + "</td></tr>"
+
+def out_HTML(data_file = None, html_file = None, gene_table = True, pathway_table = True, interactive = False):
+    # if interactive is True, the tables are written by out_interactive_HTML() instead, for very large tables
     global _html_file  # sets local _html_file to the global _html_file
     global _data_file  # sets local _data_file to the global _data_file
     if data_file == None:  # if no path to data file is passed, then
@@ -349,12 +1454,19 @@ def out_HTML(data_file = None, html_file = None, gene_table = True, pathway_tabl
         html_file = _html_file  # set local html file to the global _html_file
 
     geneList = _gene_list  # store data of genes in this List
-    pathwayList = _pathway_list  # store pathway data in this List
+    pathwayList = filtered_pathways() if pathway_table else []  # pathways linked to the genes left after filters
+    pathwayIndex = _pathway_index  # registry of every pathway by map code
 
     print("Generating Tables . . . ")  # status update for when program is generating html file
 
-    with open(html_file, "w") as f:
-        html_code = """<html>
+    if interactive:
+        out_interactive_HTML(html_file, geneList, pathwayList, pathwayIndex, gene_table, pathway_table)
+        print("Tables Complete")
+        return
+
+    # the page is written as it is generated, so it is never held in memory as a whole
+    with open_output(html_file) as f:
+        f.write("""<html>
         <head>
         <style>
             html {
@@ -491,10 +1603,10 @@ def out_HTML(data_file = None, html_file = None, gene_table = True, pathway_tabl
         </style>
         </head>
         <body>
-        <body link="#003366">"""
+        <body link="#003366">""")
 
         if gene_table:  # if true, includes table for genes
-            html_code = html_code + """
+            f.write("""
     	<div class="scrollingtable">
     		<div>
     			<div>
@@ -514,34 +1626,16 @@ def out_HTML(data_file = None, html_file = None, gene_table = True, pathway_tabl
     						</tr>
     					</thead>
     					<tbody>
-                            """
-            for gene in geneList:  # cycles through even gene; one gene each row
-                # adds the gene number, k number, and definition to first three columns
-                row = "<tr><td>" + gene.gene_num + "</td><td>" + gene.name + "</td><td>" + gene.k_code + "</td><td>" \
-                      + gene.definition + "</td><td>"
-                first_iteration = True  # used to avoid adding a ", " to the first hyperlink
-                for m_code in gene.link_path:  # cycles through each map code for pathways linked to gene
-                    m_code = m_code[:8]  # isolates the map code from the map code and name name in link_path item
-                    pathway = next(temp_pathway for temp_pathway in pathwayList if
-                                   temp_pathway.map_code == m_code)  # finds pathway that matches map code
-                    hyper_text = pathway.name + "(" + str(len(
-                        pathway.genes_invol)) + ")"  # generates the text for the hyperlink (name + num of associated genes)
-                    url = pathway.generate_url(gene.k_code)  # generates the url
-                    hyperlink = "<a href=\"" + url + "\">" + hyper_text + "</a>"  # embeds hyperlink to text
-                    if not first_iteration:
-                        hyperlink = ", " + hyperlink  # adds a ", " between hyperlinks
-                    first_iteration = False
-                    row = row + hyperlink  # adds hyperlink to row
-                row = row + "</td></tr>"  # finishes html code for end of row
-                html_code = html_code + row  # add row to html code
-            html_code = html_code + """</tbody>
+                            """)
+            f.writelines(make_gene_table_rows(geneList, pathwayIndex))
+            f.write("""</tbody>
     				</table>
     			</div>
     		</div>
-    	</div>"""
+    	</div>""")
 
         if pathway_table:  # if true, includes the two tables for pathways
-            html_code = html_code + """
+            f.write("""
     	<br />
     	<div class="scrollingtable">
     		<div>
@@ -558,7 +1652,7 @@ def out_HTML(data_file = None, html_file = None, gene_table = True, pathway_tabl
     						</tr>
     					</thead>
     					<tbody>
-                            """
+                            """)
             pathwayList.sort(key=lambda pathway: len(pathway.genes_invol), reverse=True)
             for pathway in pathwayList:
                 hyper_text = pathway.name + "(" + str(
@@ -566,8 +1660,8 @@ def out_HTML(data_file = None, html_file = None, gene_table = True, pathway_tabl
                 url = pathway.generate_url("")  # generates the url
                 hyperlink = "<a href=\"" + url + "\">" + hyper_text + "</a>"  # embeds hyperlink to text
                 row = "<tr><td>" + hyperlink + "</td></tr>"
-                html_code = html_code + row
-            html_code = html_code + """</tbody>
+                f.write(row)
+            f.write("""</tbody>
     				</table>
     			</div>
     		</div>
@@ -588,7 +1682,7 @@ def out_HTML(data_file = None, html_file = None, gene_table = True, pathway_tabl
     						</tr>
     					</thead>
     					<tbody>
-                            """
+                            """)
             pathwayList.sort(key=lambda pathway: pathway.name)
             for pathway in pathwayList:
                 hyper_text = pathway.name + "(" + str(
@@ -596,19 +1690,252 @@ def out_HTML(data_file = None, html_file = None, gene_table = True, pathway_tabl
                 url = pathway.generate_url("")  # generates the url
                 hyperlink = "<a href=\"" + url + "\">" + hyper_text + "</a>"  # embeds hyperlink to text
                 row = "<tr><td>" + hyperlink + "</td></tr>"
-                html_code = html_code + row
-            html_code = html_code + """</tbody>
+                f.write(row)
+            f.write("""</tbody>
     				</table>
     			</div>
     		</div>
     	</div>
         </body>
-        </html>"""
-        f.write(html_code)
+        </html>""")
     f.close()
 
     print("Tables Complete")  # status update for when program is finished
 
+def out_interactive_HTML(html_file, geneList, pathwayList, pathwayIndex, gene_table = True, pathway_table = True):
+    # writes the tables as data embedded in the html file instead of one <tr> per row; a small script in the page only
+    # renders the rows scrolled into view and sorts and searches them in the browser, so very large tables open at once
+    pathway_numbers = {}  # {map_code: position in pathways}
+    pathways = []  # [[map_code, map_name, [k_code, ...]], ...]; the k codes are needed to build the url of the map
+    kos = []  # [[k_code, name, definition, [pathway number, ...]], ...]; shared by every gene with the same k code
+    ko_numbers = {}  # {(k_code, link_path): position in kos}
+    genes = []  # [[gene_num, ko number], ...] in the order of geneList
+
+    def pathway_number(pathway):
+        if pathway.map_code not in pathway_numbers:
+            pathway_numbers[pathway.map_code] = len(pathways)
+            pathways.append([pathway.map_code, pathway.name, pathway.genes_invol])
+        return pathway_numbers[pathway.map_code]
+
+    if pathway_table:  # the pathways listed in the pathway table come first
+        for pathway in pathwayList:
+            pathway_number(pathway)
+    listed_pathways = len(pathways)
+    if gene_table:
+        for gene in geneList:
+            ko_number = ko_numbers.get((gene.k_code, gene.link_path))
+            if ko_number is None:
+                ko_number = ko_numbers[(gene.k_code, gene.link_path)] = len(kos)
+                kos.append([gene.k_code, gene.name, gene.definition,
+                            [pathway_number(pathwayIndex[m_code]) for m_code in gene.link_path]])
+            genes.append([gene.gene_num, ko_number])
+
+    def to_json(value):  # "<" is escaped so no value can end the script element the data is embedded in
+        return json.dumps(value, separators=(",", ":")).replace("<", "\\u003c")
+
+    with open_output(html_file) as f:
+        f.write("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+    body {background: white; text-align: center; font-family: Verdana, Tahoma, sans-serif; font-size: 15px;}
+    a {color: #003366;}
+    .report {display: inline-block; width: 95%; margin: 20px 0 20px 0; text-align: left;}
+    .report .caption {font-weight: bold; text-align: center; padding-bottom: 4px;}
+    .report .search {margin-bottom: 6px;}
+    .report .search input {width: 300px;}
+    .report table {width: 100%; table-layout: fixed; border-collapse: collapse;}
+    .report th {background: cornflowerblue; color: white; cursor: pointer; white-space: nowrap; height: 20px;
+                border: 1px solid black;}
+    .report td {height: 20px; padding: 0 6px 0 6px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;
+                border-left: 1px solid black; border-bottom: 1px solid black;}
+    .report tr:nth-child(even) {background: gainsboro;}
+    .report .viewport {position: relative; height: 600px; overflow-y: scroll; border: 1px solid black; border-top: none;}
+    .report .viewport table {position: absolute; top: 0; left: 0;}
+    .report .status {font-size: 12px; padding-top: 4px;}
+</style>
+</head>
+<body>
+<script type="application/json" id="gaev-data">{"pathways":""")
+        f.write(to_json(pathways))
+        f.write(""","listed_pathways":""" + str(listed_pathways) + ""","kos":""")
+        f.write(to_json(kos))
+        f.write(""","genes":""")
+        for start in range(0, max(len(genes), 1), 10000):  # the gene list is written in parts so it is never a single string
+            f.write(("[" if start == 0 else ",") + to_json(genes[start:start + 10000])[1:-1])
+        f.write("""]}</script>
+""")
+        if gene_table:
+            f.write("""<div class="report" id="genes">
+    <div class="caption">Genes and Linked Pathway</div>
+    <div class="search">Search <select>
+        <option value="all">all</option><option value="name">name</option><option value="definition">definition</option>
+        <option value="pathway">pathway</option></select> <input type="text"></div>
+    <table><colgroup><col style="width: 12%"><col style="width: 10%"><col style="width: 8%"><col style="width: 30%">
+        <col style="width: 40%"></colgroup>
+        <thead><tr><th>Gene ID</th><th>Gene Name</th><th>K Number</th><th>Definition</th><th>Pathway</th></tr></thead>
+    </table>
+    <div class="viewport"><div class="spacer"></div><table><colgroup><col style="width: 12%"><col style="width: 10%">
+        <col style="width: 8%"><col style="width: 30%"><col style="width: 40%"></colgroup><tbody></tbody></table></div>
+    <div class="status"></div>
+</div>
+""")
+        if pathway_table:
+            f.write("""<div class="report" id="pathways">
+    <div class="caption">Pathways and Number of Associated Genes</div>
+    <div class="search">Search pathway <input type="text"></div>
+    <table><colgroup><col style="width: 80%"><col style="width: 20%"></colgroup>
+        <thead><tr><th>Pathway</th><th>Associated Genes</th></tr></thead>
+    </table>
+    <div class="viewport"><div class="spacer"></div><table><colgroup><col style="width: 80%"><col style="width: 20%">
+        </colgroup><tbody></tbody></table></div>
+    <div class="status"></div>
+</div>
+""")
+        f.write("""<script>
+(function () {
+    var data = JSON.parse(document.getElementById("gaev-data").textContent);
+    var rowHeight = 21;  // height of a row, including its bottom border
+    var urls = [];  // start of the url of each pathway map, built when first needed
+
+    function escapeHtml(text) {
+        return String(text).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+    }
+
+    // same url as Pathway_MAP.generate_url(): every gene of the pathway in green and the selected gene in red
+    function pathwayLink(number, k_code) {
+        var pathway = data.pathways[number];
+        if (urls[number] === undefined) {
+            urls[number] = "http://www.kegg.jp/kegg-bin/show_pathway?map=" + pathway[0] + "&multi_query=" +
+                pathway[2].map(function (k) { return k + "+%23bfffbf%0d%0a"; }).join("");
+        }
+        return "<a href=\\"" + escapeHtml(urls[number] + k_code + "+%238B0000,%23F0F8FF") + "\\">" +
+            escapeHtml(pathway[1] + "(" + pathway[2].length + ")") + "</a>";
+    }
+
+    function compare(a, b) { return a < b ? -1 : (a > b ? 1 : 0); }
+
+    // table that only renders the rows scrolled into view; keys[c](row) gives the value column c is sorted by
+    function VirtualTable(element, rowCount, renderRow, keys, sortColumn, descending) {
+        var viewport = element.querySelector(".viewport");
+        var spacer = element.querySelector(".spacer");
+        var body = viewport.querySelector("tbody");
+        var table = viewport.querySelector("table");
+        var status = element.querySelector(".status");
+        var all = [];
+        for (var i = 0; i < rowCount; i++) { all.push(i); }
+        var rows = all;  // rows left after searching, in display order
+        var drawn = -1;
+
+        function draw(force) {
+            var first = Math.max(0, Math.floor(viewport.scrollTop / rowHeight) - 10);
+            if (first === drawn && !force) { return; }
+            drawn = first;
+            var last = Math.min(rows.length, first + Math.ceil(viewport.clientHeight / rowHeight) + 20);
+            var html = [];
+            for (var i = first; i < last; i++) { html.push(renderRow(rows[i])); }
+            body.innerHTML = html.join("");
+            table.style.top = (first * rowHeight) + "px";
+        }
+
+        function sort() {
+            if (sortColumn < 0) { return; }  // not sorted yet; rows stay in the order of the data file
+            var key = keys[sortColumn];
+            var values = new Array(rowCount);
+            rows.forEach(function (row) { values[row] = key(row); });
+            rows.sort(function (a, b) {
+                return descending ? compare(values[b], values[a]) || a - b : compare(values[a], values[b]) || a - b;
+            });
+        }
+
+        this.show = function (filter) {  // keeps only the rows for which filter(row) is true
+            rows = filter ? all.filter(filter) : all.slice();
+            sort();
+            spacer.style.height = (rows.length * rowHeight) + "px";
+            status.textContent = rows.length + " of " + rowCount + " rows";
+            viewport.scrollTop = 0;
+            draw(true);
+        };
+
+        var headers = element.querySelectorAll("thead th");
+        Array.prototype.forEach.call(headers, function (header, column) {
+            header.title = "Sort";
+            header.addEventListener("click", function () {
+                descending = column === sortColumn ? !descending : false;
+                sortColumn = column;
+                sort();
+                viewport.scrollTop = 0;
+                draw(true);
+            });
+        });
+        viewport.addEventListener("scroll", function () { draw(false); });
+        window.addEventListener("resize", function () { draw(true); });
+    }
+
+    // calls update() once the user stopped typing for a moment
+    function onSearch(element, update) {
+        var timer = null;
+        Array.prototype.forEach.call(element.querySelectorAll(".search input, .search select"), function (input) {
+            input.addEventListener(input.tagName === "SELECT" ? "change" : "input", function () {
+                clearTimeout(timer);
+                timer = setTimeout(update, 150);
+            });
+        });
+    }
+
+    var geneElement = document.getElementById("genes");
+    if (geneElement) {
+        var kos = data.kos.map(function (ko) {  // lower case text searched for each k code, like GAEV's filters
+            return {name: ko[1].toLowerCase(), definition: ko[2].toLowerCase(),
+                    pathway: ko[3].map(function (number) { return data.pathways[number][1].toLowerCase(); }).join("\\n")};
+        });
+        var genes = new VirtualTable(geneElement, data.genes.length, function (row) {
+            var gene = data.genes[row], ko = data.kos[gene[1]];
+            return "<tr><td>" + escapeHtml(gene[0]) + "</td><td>" + escapeHtml(ko[1]) + "</td><td>" + escapeHtml(ko[0]) +
+                "</td><td title=\\"" + escapeHtml(ko[2]) + "\\">" + escapeHtml(ko[2]) + "</td><td title=\\"" +
+                escapeHtml(ko[3].map(function (number) { return data.pathways[number][1]; }).join(", ")) + "\\">" +
+                ko[3].map(function (number) { return pathwayLink(number, ko[0]); }).join(", ") + "</td></tr>";
+        }, [
+            function (row) { return data.genes[row][0]; },
+            function (row) { return data.kos[data.genes[row][1]][1]; },
+            function (row) { return data.kos[data.genes[row][1]][0]; },
+            function (row) { return data.kos[data.genes[row][1]][2]; },
+            function (row) { return data.kos[data.genes[row][1]][3].length; }
+        ], -1, false);
+        onSearch(geneElement, function () {
+            var target = geneElement.querySelector(".search input").value.toLowerCase();
+            var field = geneElement.querySelector(".search select").value;
+            if (!target) { genes.show(null); return; }
+            var matches = kos.map(function (ko) {
+                return field === "all" ? ko.name.indexOf(target) >= 0 || ko.definition.indexOf(target) >= 0 ||
+                    ko.pathway.indexOf(target) >= 0 : ko[field].indexOf(target) >= 0;
+            });
+            genes.show(function (row) { return matches[data.genes[row][1]]; });
+        });
+        genes.show(null);
+    }
+
+    var pathwayElement = document.getElementById("pathways");
+    if (pathwayElement) {
+        var pathways = new VirtualTable(pathwayElement, data.listed_pathways, function (row) {
+            return "<tr><td>" + pathwayLink(row, "") + "</td><td>" + data.pathways[row][2].length + "</td></tr>";
+        }, [
+            function (row) { return data.pathways[row][1]; },
+            function (row) { return data.pathways[row][2].length; }
+        ], 1, true);
+        onSearch(pathwayElement, function () {
+            var target = pathwayElement.querySelector(".search input").value.toLowerCase();
+            pathways.show(target ? function (row) { return data.pathways[row][1].toLowerCase().indexOf(target) >= 0; } : null);
+        });
+        pathways.show(null);
+    }
+})();
+</script>
+</body>
+</html>
+""")
+
 def out_txt(output_file = None):
     global _input_file  # sets local _input_file to the global _input_file
     global _html_file  # sets local _html_file to the global _html_file
@@ -622,16 +1949,14 @@ def out_txt(output_file = None):
         output_file = output_name + ".txt"
 
     geneList = _gene_list  # store data of genes in this List
-    pathwayList = _pathway_list  # store pathway data in this List
+    pathwayIndex = _pathway_index  # registry of every pathway by map code
 
     with open(output_file, "w") as f:
         f.write("GeneID\tSymbol\tDefinition\n")
         for gene in geneList:
             line = str(gene.gene_num) + "\t" + str(gene.name) + "\t" + str(gene.definition) + "\t"
             for m_code in gene.link_path:  # cycles through each map code for pathways linked to gene
-                m_code = m_code[:8]  # isolates the map code from the map code and name name in link_path item
-                pathway = next(temp_pathway for temp_pathway in pathwayList if
-                               temp_pathway.map_code == m_code)  # finds pathway that matches map code
+                pathway = pathwayIndex[m_code]  # finds pathway that matches map code
                 pathway_name = pathway.name  # stores the name of the pathway in a string to manipulate later
                 hyper_text = pathway_name.replace(" ", "_") + "(" + str(len(
                     pathway.genes_invol)) + ")"  # generates the text for the hyperlink (name + num of associated genes)
@@ -639,6 +1964,401 @@ def out_txt(output_file = None):
             line = line + "\n"  # add a new line after finishes storing everything to be written on that line
             f.write(line)
 
+############ Pipeline ############
+# every step of GAEV can be run without the menus: annotate() and load() return a Dataset, which is filtered and
+# rendered by its methods, and color_pathways() writes the page of Color Pathways. The menus and the command line
+# (see main()) are built on these steps
+_dataset_variables = ("_input_file", "_trimmed_file", "_data_file", "_html_file", "_pathway_list", "_pathway_index",
+                      "_gene_list", "_total_genes", "_filter_stack", "_filtered_pathways", "_filter_index", "_incidence")
+_dataset = None  # will store the Dataset whose genes and pathways are in the variables named in _dataset_variables
+_table_types = ("both", "genes", "pathways", "interactive")  # tables write_tables() can write, in the order of the menu
+
+class Dataset:  # genes and pathways of one data file and the filters applied to them
+    # the functions of GAEV work on the variables named in _dataset_variables; a Dataset keeps its own values of them
+    # while another Dataset is used, and puts them back in place before any of its methods runs
+    def __init__(self, data_file = None, lazy = None):  # loads data_file, see load_data(); None creates an empty dataset
+        self.variables = {"_input_file": "No_File_Specified", "_trimmed_file": "No_File_Specified",
+                          "_data_file": "No_File_Specified", "_html_file": "No_File_Specified", "_pathway_list": [],
+                          "_pathway_index": {}, "_gene_list": [], "_total_genes": 0, "_filter_stack": [],
+                          "_filtered_pathways": None, "_filter_index": None, "_incidence": None}
+        if data_file is not None:
+            self.use()
+            set_data_file(data_file)
+            load_data(lazy = lazy)
+
+    def use(self):  # makes this the dataset the functions of GAEV work on
+        global _dataset  # sets local _dataset to global _dataset
+        if _dataset is not self:
+            if _dataset is not None:  # keeps the values of the dataset used until now
+                _dataset.variables = {name: globals()[name] for name in _dataset_variables}
+            globals().update(self.variables)
+            _dataset = self
+        return self
+
+    @property
+    def data_file(self):
+        self.use()
+        return _data_file
+
+    @property
+    def genes(self):  # genes kept by the filters
+        self.use()
+        return _gene_list
+
+    @property
+    def pathways(self):  # pathways linked to at least one of the genes kept by the filters
+        self.use()
+        return filtered_pathways()
+
+    @property
+    def filters(self):  # description of every filter applied, in order
+        self.use()
+        return filter_descriptions()
+
+    def filter(self, field, target, kind = "contains"):  # keeps the genes matching target in field, see filter_genes()
+        self.use()
+        filter_genes(field, target, kind)
+        return self
+
+    def query(self, expression):  # keeps the genes matching a filter expression; raises ValueError if it is not valid
+        self.use()
+        filter_genes_by_query(expression)
+        return self
+
+    def subset(self, filter_file):  # keeps the genes whose gene ID is listed in filter_file
+        self.use()
+        take_subset(filter_file)
+        return self
+
+    def undo(self):  # removes the last filter applied
+        self.use()
+        undo_filter()
+        return self
+
+    def reset(self):  # removes every filter
+        self.use()
+        restore_filters()
+        return self
+
+    def render(self, table = "both", output_file = None):  # writes the tables of the genes kept, see write_tables()
+        self.use()
+        write_tables(table, output_file)
+        return self
+
+    def close(self):  # releases the data file of a dataset read lazily
+        genes = self.genes
+        if isinstance(genes, Gene_View) and isinstance(genes.source, Gene_Records):
+            genes.source.close()
+
+def load(data_file, lazy = None):  # returns the Dataset of a complete data file
+    return Dataset(data_file, lazy)
+
+def annotate(input_file, lazy = None):  # creates the data file of an input file from KEGG and returns its Dataset
+    # the data file is created next to the input file with the same name; like the menus, GAEV exits if it already exists
+    dataset = Dataset().use()
+    set_input(input_file)  # sets the paths of the trimmed input file, data file and html file
+    trim_unannotated()  # trims the input file of genes that are not associated with a KO number
+    gen_pathway()  # accesses KEGG to extract information on the genes and pathways of the input file
+    load_data(lazy = lazy)
+    return dataset
+
+def write_tables(table = "both", output_file = None):  # writes the html and txt tables of the genes of _gene_list
+    # table is one of _table_types; output_file is the path of the html file, by default named after the data file
+    if table not in _table_types:
+        raise ValueError("table must be one of " + ", ".join(_table_types))
+    # pathways with no associated genes (were removed in filter) are left out by out_HTML via filtered_pathways()
+    out_HTML(html_file = output_file, gene_table = table != "pathways", pathway_table = table != "genes",
+             interactive = table == "interactive")
+    out_txt(output_file = output_file)
+
+def color_pathways(data_file, sets, output_file, blend = "blend"):  # colors gene sets on the pathway maps of a data file
+    # sets is a list of (path of a gene set file, color name or hex) pairs; writes the html page of Color Pathways.
+    # blend is how the colors of the genes of a k code are combined: "blend", "dominant" or "split"
+    run_color_pathways("export_pathways", data_file, sets, output_file, blend)
+
+def color_pathways_batch(data_file, manifest_file, workers = None):  # colors every configuration of a manifest file
+    # the manifest lists the gene sets and output of every page (see Color_Pathways.load_manifest()); the data file is
+    # read once for all of them and the pages are written in parallel. Returns the outcome of every configuration
+    return run_color_pathways("export_manifest", data_file, manifest_file, workers)
+
+def run_color_pathways(function_name, *args):  # runs a function of Color_Pathways and returns what it returns
+    generate_url = Pathway_MAP.generate_url  # Color_Pathways colors the urls only while it writes its pages
+    import Color_Pathways
+    Pathway_MAP.generate_url = Color_Pathways._new_generate_url
+    try:
+        return getattr(Color_Pathways, function_name)(*args)
+    finally:
+        Pathway_MAP.generate_url = generate_url
+
+def main(argv = None):  # runs the steps of the pipeline given by command line arguments, without any menu
+    parser = argparse.ArgumentParser(prog = "GAEV.py", description = "Gene Annotation Easy Viewer. Run without "
+                                     "arguments to choose every step from menus instead.")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    annotate_parser = commands.add_parser("annotate", help = "create data files from input files, then write tables")
+    annotate_parser.add_argument("files", nargs = "+", metavar = "input_file")
+    render_parser = commands.add_parser("render", help = "write tables from existing data files")
+    render_parser.add_argument("files", nargs = "+", metavar = "data_file")
+    upgrade_parser = commands.add_parser("upgrade", help = "convert data files made by older versions of GAEV to the "
+                                         "current format, which loads faster")
+    upgrade_parser.add_argument("files", nargs = "+", metavar = "data_file")
+    index_parser = commands.add_parser("build-index", help = "compile downloaded KEGG files into an offline index, or "
+                                       "add them to an existing one (see README)")
+    index_parser.add_argument("index_file")
+    index_parser.add_argument("kegg_files", nargs = "+", metavar = "kegg_file", help = "the 'ko' flat file, or the "
+                              "'list/ko', 'link/pathway/ko' and 'list/pathway' files of the KEGG REST API")
+    for command_parser in (annotate_parser, render_parser):
+        # every filter is kept as (step, argument) in the order given, since each one filters the genes of the last
+        for step, metavar, help_text in (("name", "TEXT", "keep genes whose name contains TEXT"),
+                                         ("definition", "TEXT", "keep genes whose definition contains TEXT"),
+                                         ("pathway", "TEXT", "keep genes with a pathway name containing TEXT"),
+                                         ("query", "EXPRESSION", 'keep genes matching a filter expression '
+                                                                 '(ex. "definition:kinase AND NOT pathway:cancer")'),
+                                         ("subset", "FILE", "keep genes whose gene ID is listed in FILE")):
+            command_parser.add_argument("--" + step, dest = "filters", metavar = metavar, action = "append", default = [],
+                                        type = lambda text, step = step: (step, text), help = help_text)
+        command_parser.add_argument("--table", choices = _table_types + ("none",), default = "both",
+                                    help = "tables to write (default: both); none only creates the data files")
+        command_parser.add_argument("--output", help = "path of the html file (only with a single file)")
+    color_parser = commands.add_parser("color-pathways", help = "color gene sets on the pathway maps of a data file")
+    color_parser.add_argument("data_file")
+    color_source = color_parser.add_mutually_exclusive_group(required = True)  # one page, or every page of a manifest
+    color_source.add_argument("--set", dest = "sets", nargs = 2, action = "append", metavar = ("GENE_SET_FILE", "COLOR"),
+                              help = "gene IDs to color, one per line, and their color name or hex; may be repeated")
+    color_parser.add_argument("--output", help = "path of the html file")
+    color_source.add_argument("--manifest", help = "json file listing the sets, output and blend of many pages to "
+                              "write instead of --set, --output and --blend (see README)")
+    color_parser.add_argument("--workers", type = int, help = "number of pages of a manifest written at once "
+                              "(default: number of processors)")
+    color_parser.add_argument("--blend", choices = ("blend", "dominant", "split"),
+                              help = "how a K number of genes in sets of different colors is colored: a mix weighted by "
+                              "number of genes (default), the color of most genes, or that color with the second one "
+                              "as its text color")
+    args = parser.parse_args(argv)
+
+    if args.command == "upgrade":
+        for file in args.files:
+            if upgrade_data_file(file):
+                print(file + ": upgraded")
+            else:
+                print(file + ": already in the current format")
+        return
+    if args.command == "build-index":
+        missing = [kegg_file for kegg_file in args.kegg_files if not os.path.isfile(kegg_file)]
+        if missing:
+            index_parser.error("KEGG file not found: " + ", ".join(missing))
+        build_offline_index(args.index_file, args.kegg_files)
+        return
+    if args.command == "color-pathways":
+        if args.manifest:
+            for option, value in (("--output", args.output), ("--blend", args.blend)):
+                if value is not None:  # every page of a manifest has its own output and blend
+                    color_parser.error("argument " + option + ": not allowed with argument --manifest")
+            results = color_pathways_batch(args.data_file, args.manifest, args.workers)
+            if any(result["status"] != "ok" for result in results):
+                sys.exit(1)
+        elif args.output:
+            color_pathways(args.data_file, [tuple(gene_set) for gene_set in args.sets], args.output,
+                           args.blend or "blend")
+        else:
+            color_parser.error("the following arguments are required with --set: --output")
+        return
+    if args.output and len(args.files) > 1:
+        parser.error("--output can only be used with a single file")
+    failed = []  # files that could not be processed; the other files are still processed
+    for file in args.files:
+        try:
+            dataset = annotate(file) if args.command == "annotate" else load(file)
+        except SystemExit as error:  # GAEV exits with a message when a file cannot be processed, see gen_pathway()
+            print(file + ": " + str(error.code))
+            failed.append(file)
+            continue
+        print(os.path.basename(dataset.data_file) + ": " + str(len(dataset.genes)) + " genes")
+        for step, argument in args.filters:
+            try:
+                if step == "query":
+                    dataset.query(argument)
+                elif step == "subset":
+                    dataset.subset(argument)
+                else:
+                    dataset.filter(step, argument)
+            except ValueError as error:
+                sys.exit("Not a valid expression: " + str(error))
+            print(dataset.filters[-1] + ": " + str(len(dataset.genes)) + " genes")
+        if args.table != "none":
+            if not len(dataset.genes):  # an empty table is most likely a filter that was mistyped
+                print(os.path.basename(dataset.data_file) + ": no genes are left after the filters, so no tables "
+                      "were written")
+                failed.append(file)
+            else:
+                dataset.render(args.table, args.output)
+        dataset.close()
+    if failed:
+        sys.exit(str(len(failed)) + " of " + str(len(args.files)) + " files failed: " + ", ".join(failed))
+
+############ Batch Runs ############
+# every file of a batch run is processed by its own worker process, so the global variables one file sets (_gene_list,
+# _data_file, ...) never mix with those of another file; what each worker prints is written to a log next to its output
+def run_batch_job(data, file, user_inputs, fetch_workers = None):  # processes one file of a batch run in a worker process
+    # replays user_inputs through the same menus as a single run and returns the manifest entry of the file
+    global _fetch_workers  # sets local _fetch_workers to global _fetch_workers
+    if fetch_workers is not None:  # the workers share the KEGG requests allowed at once between them
+        _fetch_workers = fetch_workers
+    started = time.time()
+    file_path = os.path.abspath(file)
+    entry = {"file": file, "status": "ok", "error": "", "seconds": 0.0}
+    try:
+        if not os.path.isfile(file_path):
+            raise FileNotFoundError(file + " was not found")
+        entry["log_file"] = os.path.splitext(file_path)[0] + "-batch.log"
+        with open(entry["log_file"], "w") as log, contextlib.redirect_stdout(log):
+            if data:
+                UI().menu_data_existing(data_file = file_path, input_list = list(user_inputs))
+            else:
+                UI().menu_data_new(input_file = file_path, input_list = list(user_inputs))
+        entry["data_file"] = _data_file
+        entry["html_file"] = _html_file
+    except SystemExit as error:  # GAEV exits with a message when a file cannot be processed
+        entry["status"] = "failed"
+        entry["error"] = str(error.code)
+    except EOFError:  # the menus asked for input that a batch run cannot give, ex. because the data file is incomplete
+        entry["status"] = "failed"
+        entry["error"] = "stopped waiting for input; see " + os.path.basename(entry["log_file"])
+    except Exception as error:
+        entry["status"] = "failed"
+        entry["error"] = type(error).__name__ + ": " + str(error)
+    entry["seconds"] = round(time.time() - started, 3)
+    return entry
+
+def prefetch_batch_k_codes(file_list):  # resolves the k codes of every input file of a batch run at once
+    # most k codes are shared by the input files of a batch, so each distinct k code is resolved only once and the
+    # workers build their data files from _shared_k_codes. Returns (number of distinct k codes, number of fetches avoided)
+    file_k_codes = 0  # sum of the distinct k codes of every input file, which is what separate runs would resolve
+    k_codes = {}  # distinct k codes of all input files in the order they are first found
+    for file in file_list:
+        input_file = os.path.abspath(file)
+        try:
+            header = read_data_header(os.path.splitext(input_file)[0] + ".dat")
+            if header["completed"] and not header["provenance"].get("unresolved"):
+                continue  # the file is not annotated again, see gen_pathway()
+        except (OSError, ValueError, EOFError):  # there is no complete data file yet
+            pass
+        try:
+            with open(input_file, 'r') as f:
+                codes = {columns[1] for columns in (line.split() for line in f) if len(columns) == 2}
+        except (OSError, UnicodeDecodeError):  # the worker of this file reports the error
+            continue
+        file_k_codes = file_k_codes + len(codes)
+        k_codes.update(dict.fromkeys(sorted(codes)))
+    print("Resolving " + str(len(k_codes)) + " unique K-codes for the batch (" +
+          str(file_k_codes - len(k_codes)) + " fetches avoided)")
+    resolved, failed = resolve_k_codes(list(k_codes))
+    if failed:  # each worker tries the k codes that failed again for its own file
+        print(str(len(failed)) + " K-codes could not be retrieved and are left to each file")
+    _shared_k_codes.update(resolved)
+    return len(k_codes), file_k_codes - len(k_codes)
+
+def share_k_codes(table):  # runs in every worker process of a batch run before its first file
+    global _ko_cache  # sets local _ko_cache to global _ko_cache
+    _ko_cache = None  # a connection copied from the parent process must not be used; each worker opens its own
+    _shared_k_codes.update(table)
+
+def run_batch(data, file_list, user_inputs, workers = None, manifest_file = None):  # processes every file of a batch run
+    # runs up to workers files at once; a file that fails does not stop the others. Writes the status and time of every
+    # file to manifest_file and returns the manifest entries in the order of file_list
+    if workers is None:  # if the number of workers is not specified, use the global number
+        workers = _batch_workers
+    if manifest_file is None:
+        manifest_file = _batch_manifest_file
+    file_list = list(dict.fromkeys(file_list))  # a file listed twice would have two workers writing the same outputs
+    workers = max(1, min(workers, len(file_list)))
+    fetch_workers = max(1, _fetch_workers // workers)  # keeps the KEGG requests in flight the same as for one file
+    started = time.time()
+    entries = {file: {"file": file, "status": "not run", "error": "", "seconds": 0.0} for file in file_list}
+    manifest = {"started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)), "workers": workers,
+                "data_files": data}
+    if not data:  # input files are annotated, so the k codes they share are resolved once for all of them
+        manifest["unique_k_codes"], manifest["fetches_avoided"] = prefetch_batch_k_codes(file_list)
+    print("Processing " + str(len(file_list)) + " files, " + str(workers) + " at once")
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=share_k_codes,
+                                                  initargs=(_shared_k_codes,))
+    try:
+        futures = {pool.submit(run_batch_job, data, file, user_inputs, fetch_workers): file for file in file_list}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            file = futures[future]
+            try:
+                entries[file] = future.result()
+            except Exception as error:  # ex. the worker process was killed
+                entries[file] = {"file": file, "status": "failed", "error": type(error).__name__ + ": " + str(error),
+                                 "seconds": 0.0}
+            entry = entries[file]
+            print("[" + str(done) + "/" + str(len(file_list)) + "] " + file + ": " + entry["status"] +
+                  " (" + str(entry["seconds"]) + " s)" + (" " + entry["error"] if entry["error"] else ""))
+    finally:  # the manifest is written even if the batch run is interrupted
+        pool.shutdown(wait=True, cancel_futures=True)
+        manifest["seconds"] = round(time.time() - started, 3)
+        manifest["files"] = [entries[file] for file in file_list]
+        with open(manifest_file, "w") as f:
+            json.dump(manifest, f, indent=1)
+    failed = sum(entry["status"] != "ok" for entry in manifest["files"])
+    print(str(len(file_list) - failed) + " of " + str(len(file_list)) + " files processed in " +
+          str(manifest["seconds"]) + " s; see " + manifest_file)
+    return manifest["files"]
+
+def run_subset_job(filter_file, table_choice, html_file, depth):  # filters one subset of a batch and writes its table
+    # runs in a worker forked after the genes, _subset_index and the pathway incidence were built, so it reads them
+    # from the memory of the parent process instead of copying or rebuilding them; returns the outcome of the subset
+    restore_filters(depth)  # removes the subset this worker filtered before
+    result = {"file": filter_file, "status": "ok", "error": "", "html_file": html_file, "matched": 0, "not_found": 0}
+    log = io.StringIO()  # the menus print the same text for every subset, so it is only kept to report errors
+    try:
+        with contextlib.redirect_stdout(log):
+            result["matched"], result["not_found"] = take_subset(filter_file, _subset_index)
+            if len(_gene_list) == 0:
+                result["status"] = "no genes"
+            else:
+                UI().menu_table_type(custom_name = html_file, input_list = [table_choice])
+    except SystemExit as error:  # ex. the filter file was not found
+        result["status"] = "failed"
+        result["error"] = str(error.code)
+    except Exception as error:
+        result["status"] = "failed"
+        result["error"] = type(error).__name__ + ": " + str(error)
+    finally:
+        restore_filters(depth)
+    return result
+
+def run_subset_batch(filter_files, table_choice, workers = None):  # writes a table for every subset in filter_files
+    # the gene IDs of _gene_list are indexed once, then the subsets are filtered by forked workers sharing that index
+    global _subset_index  # sets local _subset_index to global _subset_index
+    if workers is None:  # if the number of workers is not specified, use the global number
+        workers = _batch_workers
+    depth = len(_filter_stack)  # filters applied before the subsets, which every subset is filtered from
+    _subset_index = gene_id_positions(_gene_list)
+    open_incidence()  # built before the workers are forked so they share it
+    html_dir = os.path.dirname(_html_file)
+    jobs = [(filter_file, table_choice, os.path.join(html_dir, os.path.splitext(filter_file)[0] + "-table.html"), depth)
+            for filter_file in filter_files]
+    workers = max(1, min(workers, len(jobs)))
+    print("Filtering " + str(len(jobs)) + " subsets, " + str(workers) + " at once")
+    try:
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                        mp_context=multiprocessing.get_context("fork")) as pool:
+                results = list(pool.map(run_subset_job, *zip(*jobs)))
+        else:  # without fork the workers would have to copy the genes, so the subsets are filtered one at a time
+            results = [run_subset_job(*job) for job in jobs]
+    finally:
+        _subset_index = None
+    for result in results:
+        if result["status"] == "ok":
+            print(result["file"] + ": " + str(result["matched"]) + " gene IDs matched, " + str(result["not_found"]) +
+                  " were not found -> " + os.path.basename(result["html_file"]))
+        elif result["status"] == "no genes":
+            print(result["file"] + ": none of the gene IDs matched, no table written")
+        else:
+            print(result["file"] + ": failed (" + result["error"] + ")")
+    return results
+
 ############ User Interface ############
 class UI:  # class to wrap all the menu screens that will help user navigate the program
     def menu_data(self):  # first menu that will ask whether to create new data file or use a pre-existing one
@@ -649,6 +2369,7 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
                                     3) Create a new data file and generate a table from a new dataset of KO numbers (Batch)
                                     4) Generate a new table from an existing data file (Batch)
                                     5) Color pathways from an existing data file
+                                    6) Build an offline KEGG index from downloaded KEGG files
                                 """))  # displays options for
         choice = input("Input a digit for your choice: ")  # ask user for input as a single digit
         if choice == '1':  # if user chose '1'
@@ -661,6 +2382,8 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
             self.menu_batch_list(data = True)  # then initiate menu branch for processing multiple data files at once
         elif choice == '5':  # if user chose '5'
             self.menu_color_pathways()  # then initiate UI for annotation genes in pathways with color
+        elif choice == '6':  # if user chose '6'
+            self.menu_offline_index()  # then initiate menu branch for annotating without access to KEGG
         else:  # if input was not 1 or 2, then ask again
             print("Not a valid choice")
             self.menu_data()
@@ -672,22 +2395,14 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
         if input_file == None:
             input_file = input()  # accepts user specified path to input file and stores as string in input_file
 
-        set_input(input_file)  # uses user specified path to set paths and file names the code will use
-        if os.path.isfile(_input_file):  # checks if the file specified by the user exists
+        if os.path.isfile(input_file):  # checks if the file specified by the user exists
             print(textwrap.dedent("""
-                                     Trimming input file"""))  # status update
-            trim_unannotated()  # trim the data file of genes that are not associated with a KO number
-            print(textwrap.dedent("""
-                                     Trimming input file (complete)
-                                     
-                                     Extracting data from KEGG"""))  #status update
-            gen_pathway()  # accesses KEGG API to extract information on genes and pathways associated with input KO#s
-            load_data()  # loads data from newly generated data file to populate _gene_list and _pathway_list
-
+                                     Trimming input file and extracting data from KEGG"""))  # status update
+            annotate(input_file)  # creates the data file and loads it to populate _gene_list and _pathway_list
             print(textwrap.dedent("""Extracting data from KEGG (complete)"""))  # status update
             self.menu_filters(input_list = input_list)
         else:  # if file could not be found, then re-prompt for input file location
-            print(_input_file + " was not found")
+            print(os.path.abspath(input_file) + " was not found")
             self.menu_data_new(input_list = input_list)
 
     def menu_data_existing(self, data_file = None, input_list = None):  # does not extract any info from KEGG, but uses pre-generated data file
@@ -702,17 +2417,17 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
             extension = ".dat"  # sets extension to ".dat" to pass the next if statement
         if extension.lower() == ".dat":  # checks if the file has the correct extension
             try:  # try to open data file
-                with open(data_file, 'rb') as f:
-                    if pickle.load(f):  # loads first value from data file which is a boolean indicating if file is complete
-                        set_data_file(data_file)  # if file is complete, then set paths using the path the user input
-                        load_data(data_file)  # loads lists in data file into global variables to be used
-                        self.menu_filters(input_list = input_list)
-                    else:  # if the file is incomplete, return to first menu
-                        print("Data file is incomplete")
-                        self.menu_data()  # returns user to first menu where they may complete the data file
+                completed = read_data_header(data_file)["completed"]  # reads whether the data file is complete
             except FileNotFoundError:  # if file could not be found, then re-prompt for data file location
                 print(data_file + " was not found")
                 self.menu_data_existing(input_list = input_list)
+                return
+            if completed:
+                load(data_file)  # loads lists in data file into global variables to be used
+                self.menu_filters(input_list = input_list)
+            else:  # if the file is incomplete, return to first menu
+                print("Data file is incomplete")
+                self.menu_data()  # returns user to first menu where they may complete the data file
         else:  # if file does not have the correct format ".dat"
             print(textwrap.dedent("""
                                          Please choose a dat file as the data file."""))  # inform user of error
@@ -768,14 +2483,39 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
         user_inputs.append("")  # adds choice of no custom name
         user_inputs.append(self.menu_table_type(batch_ask = True, custom_name = None))  # adds choice of table type
 
-        for file in file_list:
-            temp_inputs = user_inputs[:]
-            if data:
-                self.menu_data_existing(data_file = file, input_list = temp_inputs)
+        print(textwrap.dedent("""
+                                 Enter the number of files to process at once or press ENTER to use the default [""" + str(_batch_workers) + """]:
+                                 """))
+        choice = input().strip()
+        workers = int(choice) if choice.isdigit() and int(choice) > 0 else _batch_workers
+        run_batch(data, file_list, user_inputs, workers)  # every file is processed by its own worker process
+
+    def menu_offline_index(self):  # menu that compiles downloaded KEGG files into an index used instead of KEGG
+        global _offline_index_file  # sets local _offline_index_file to global _offline_index_file
+        global _offline_index  # sets local _offline_index to global _offline_index
+        print(textwrap.dedent("""
+                                 Enter the path of the offline index to create or update, or press ENTER to use the default [kegg_index.sqlite]:
+                                 """))
+        index_file = input().strip() or "kegg_index.sqlite"
+        print(textwrap.dedent("""
+                                 Enter the paths to the downloaded KEGG files, one per line, followed by an empty line.
+                                 Accepted files are the 'ko' flat file and the 'list/ko', 'link/pathway/ko' and 'list/pathway' files
+                                 from the KEGG REST API. Files that were already added and have not changed are skipped.
+                                 """))
+        kegg_files = []  # list of KEGG file paths to compile into the index
+        for kegg_file in iter(input, ""):  # reads paths until an empty line is entered
+            if os.path.isfile(kegg_file.strip()):
+                kegg_files.append(kegg_file.strip())
             else:
-                self.menu_data_new(input_file = file, input_list = temp_inputs)
+                print(kegg_file + " was not found")
+        build_offline_index(index_file, kegg_files)
+        _offline_index_file = index_file  # new data files of this session are annotated from the index
+        _offline_index = None  # the index is reopened on next use so it includes the files just added
+        print("Offline mode enabled. New data files will be annotated from " + index_file + " without accessing KEGG.")
+        self.menu_data()
 
     def menu_color_pathways(self):
+        import tkinter as tk  # only the Color Pathways window needs tkinter, so GAEV also runs where it is missing
         import Color_Pathways
         Pathway_MAP.generate_url = Color_Pathways._new_generate_url  # overrides the generate_url method to include unique color value
         root = tk.Tk()
@@ -783,7 +2523,7 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
 
 
     def menu_filters(self, batch_ask = False, input_list = None, filter_batch_run = False):  # ask whether user would like to filter data
-        filter_present = len(_gene_list) != _total_genes  # determines whether a filter is present
+        filter_present = bool(_filter_stack)  # determines whether a filter is present
         if not filter_present:
             print(textwrap.dedent("""
                                      Would you like to filter the data?
@@ -791,11 +2531,15 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
                                         2) No
                                      """))
         else:
+            print("\nFilters applied:")
+            for number, description in enumerate(filter_descriptions(), 1):
+                print("    " + str(number) + ") " + description)
             print(textwrap.dedent("""
                                      Would you like to apply another filter?
                                         1) Yes
                                         2) No
                                         3) Remove all filters
+                                        4) Undo the last filter
                                      """))
 
         if input_list:  # if this is a batch run with a list of user inputs available...
@@ -815,7 +2559,12 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
                 return choice  # return user input to not filter data
             self.menu_table_name(input_list = input_list)
         elif choice == '3':
-            load_data()  # program will repopulate gene and pathway lists to reverse effects of filters
+            restore_filters()  # restores the genes from before any filter, without reading the data file again
+            print("Number of genes after filters removed: " + str(len(_gene_list)))
+            self.menu_filters(input_list = input_list)
+        elif choice == '4' and filter_present:
+            print("Removed filter: " + undo_filter())
+            print("Number of genes after filter removed: " + str(len(_gene_list)))
             self.menu_filters(input_list = input_list)
         else:
             print("Not a valid choice")
@@ -830,7 +2579,8 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
                                     2) Definition
                                     3) Pathway
                                     4) Subset of genes based on another input file
-                                    5) Go back to previous menu
+                                    5) Expression combining several searches (ex. definition:kinase AND NOT pathway:cancer)
+                                    6) Go back to previous menu
                                  """))
 
         if input_list:  # if this is a batch run with a list of user inputs available...
@@ -838,9 +2588,18 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
         else:
             filter_type = input()
 
-        if filter_type in ['1','2','3', '4']:  # if user wants to go back to previous menu w/o filtering then skip below code
+        if filter_type in ['1','2','3', '4', '5']:  # if user wants to go back to previous menu w/o filtering then skip below code
 
-            if filter_type in ['1','2','3']:  # only if user picks options 1-3 does GAEV prompt for a search term
+            if filter_type == '5':  # explains how searches are combined before prompting for the expression
+                print(textwrap.dedent("""
+                                         Enter an expression combining searches with AND, OR, NOT and parentheses.
+                                         A search is text found in the name, definition or a pathway name of a gene.
+                                         Prefix it with name:, definition: or pathway: to search only that field, or
+                                         use name=, definition= or pathway= to match a whole word. Put text in double
+                                         quotes if it contains spaces.
+                                         Example: definition:"protein kinase" AND (pathway:insulin OR name=AKT1)
+                                         """))
+            if filter_type in ['1','2','3', '5']:  # only if user picks options 1-3 or 5 does GAEV prompt for a search term
                 print(textwrap.dedent("""
                                          Enter text you would like to search for: 
                                          """))
@@ -850,43 +2609,50 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
                     search = input()
 
             if batch_ask:  # if running this function only to record user input for batch run
-                if filter_type in ['1','2','3']:  # if user wanted to enter in search term
+                if filter_type in ['1','2','3', '5']:  # if user wanted to enter in search term
                     return [filter_type, search]  # return user input for filter type and search term
                 else:  # if user selected option four using a subset of genes
                     print("This option is not available during a batch run.")
                     return self.menu_filters_type(batch_ask = batch_ask, input_list = input_list, filter_batch_run = filter_batch_run)
 
-            prev_gene_list = _gene_list[:]
+            depth = len(_filter_stack)  # number of filters applied before this one
 
             if filter_type == '1':
                 print("Number of genes before filter: " + str(len(_gene_list)))  # displays number of genes before filter
-                # only keep genes that return True for check_name
-                _gene_list[:] = [gene for gene in _gene_list if gene.check_name(search)]
+                # only keep genes whose name contains the search term; same genes as check_name
+                filter_genes("name", search)
                 print("Number of genes after filter: " + str(len(_gene_list)))  # displays num of genes after filter
             elif filter_type == '2':
                 print("Number of genes before filter: " + str(len(_gene_list)))  # displays number of genes before filter
-                # only keep genes that return True for check_definition
-                _gene_list[:] = [gene for gene in _gene_list if gene.check_definition(search)]
+                # only keep genes whose definition contains the search term; same genes as check_definition
+                filter_genes("definition", search)
                 print("Number of genes after filter: " + str(len(_gene_list)))  # displays num of genes after filter
             elif filter_type == '3':
                 print("Number of genes before filter: " + str(len(_gene_list)))  # displays number of genes before filter
-                # only keep genes that return True for check_pathway
-                _gene_list[:] = [gene for gene in _gene_list if gene.check_pathway(search, _pathway_list)]
+                # only keep genes with a pathway name containing the search term; same genes as check_pathway
+                filter_genes("pathway", search)
                 print("Number of genes after filter: " + str(len(_gene_list)))  # displays num of genes after filter
             if filter_type == '4':  # if user wants to filter the data using the geneIDs of a input file containing a subset
                     print("Number of genes before filter: " + str(len(_gene_list)))  # displays number of genes before filter
                     # only keep genes that return True for check_name
                     is_single_subset = self.menu_filters_type_subset(input_list)  # start menu branch for filtering by input file with subset of genes
                     print("Number of genes after filter: " + str(len(_gene_list)))  # displays num of genes after filter
+            elif filter_type == '5':
+                print("Number of genes before filter: " + str(len(_gene_list)))  # displays number of genes before filter
+                try:
+                    filter_genes_by_query(search)  # only keep genes matching the whole expression
+                except ValueError as error:
+                    print("Not a valid expression: " + str(error))
+                print("Number of genes after filter: " + str(len(_gene_list)))  # displays num of genes after filter
 
             if len(_gene_list) == 0:
                 print("No entries found with that search. Reverting filter.")
-                _gene_list = prev_gene_list[:]
+                restore_filters(depth)
                 print("Number of genes after previous filter reverted: " + str(len(_gene_list)))
             if filter_type != '4' or input_list or is_single_subset:  # prevents the additional prompting of menu after batch run is finished
                 self.menu_filters(input_list = input_list)  # if a valid choice was made then go back to the menu.filters menu
 
-        elif filter_type == '5':
+        elif filter_type == '6':
             if batch_ask:  # if chooses not to apply filter afterall during questions for batch run...
                 return '0'  # return 0 to alert program that no filter will be used (batch run can only ask once currently)
             else:
@@ -897,11 +2663,6 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
             self.menu_filters_type(input_list = input_list)  # and return to same menu for allow re-input
 
     def menu_filters_type_subset(self, input_list = None):
-        global _gene_list
-        global _pathway_list
-        original_gene_list = _gene_list[:]  # contains the original _gene_list to refresh after manipulation
-        original_pathway_list = _pathway_list[:]  # contains the original _pathway_list to refresh after manipulation
-
         print(textwrap.dedent("""
                                  Please enter the absolute or relative path of the input file you would like to filter by:
                                  
@@ -928,20 +2689,10 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
                 for line in f:  # for each line (input file) in the test file...
                     input_file_list.append(line.strip())  # store the input file in the appropriate list
             table_type_choice = self.menu_table_type(batch_ask = True, custom_name = None)  # stores user's choice of table type
-            for filter_file in input_file_list:  # for each input file in the list to be used to filter the data
-                _gene_list = original_gene_list[:]  # refreshes the _gene_list to the original unfiltered state
-                _pathway_list = original_pathway_list[:]  # refreshes the _pathway_list to the original unfiltered state
-
-                filter_file_no_ext, filter_file_ext = os.path.splitext(filter_file)  # seperates name w/o ext to pass as custom name
-                filter_file_no_ext = filter_file_no_ext + "-table"  # prevents script from overriding original file
-
-                user_input = ['1','4', filter_file, '2', filter_file_no_ext, table_type_choice]  # general user input to repeat during batch run
-                trimmed_file_for_filter = trim_unannotated(filter_file)  # trim the input file to be in the correct format
-                take_subset(trimmed_file_for_filter)  # filter the data by only using genes from the provided input_file
-                self.menu_filters(input_list = user_input, filter_batch_run = True)
+            # every input file gets a table named after it with "-table" added, so the original file is not overridden
+            run_subset_batch([filter_file for filter_file in input_file_list if filter_file], table_type_choice)
         else:
-            trimmed_file_for_filter = trim_unannotated(input_file)
-            take_subset(trimmed_file_for_filter)
+            take_subset(input_file)
             return True  # ensures correct menus are prompted after this choice is chosen
 
 
@@ -967,8 +2718,10 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
                                     1) Generate a table of genes and pathways (HTML + txt)
                                     2) Generate a table of genes (HTML + txt)
                                     3) Generate a table of pathways (HTML + txt)
+                                    4) Generate an interactive table of genes and pathways for large datasets (HTML + txt)
                                     
                                     Note: Option 1 is recommended. Embedded links are in the HTML file which can be opened by most browsers.
+                                          Option 4 can be sorted and searched in the browser, and opens quickly for any number of genes.
                                  """))
         if input_list:  # if this is a batch run with a list of user inputs available...
             choice = input_list.pop(0)  # use the choice from the user input list instead of prompting a new input
@@ -978,27 +2731,18 @@ class UI:  # class to wrap all the menu screens that will help user navigate the
         if batch_ask:  # if running this function only to record user input for batch run
             return choice  # return user's choice of table type
 
-        print("\nCreating table\n")  # status update so user knows that script is processing
-
-        # if pathway tables needs to be generated and some genes have been filtered
-        if (choice in ['1', '3']) and len(_gene_list) != _total_genes:
-            # trims _pathway_list to remove pathways where with no associated genes (were removed in filter)
-            _pathway_list[:] = [pathway for pathway in _pathway_list if pathway.check_genes(_gene_list)]
-
-        if choice == '1':
-            out_HTML(html_file=custom_name)  # generates both genes and pathways tables, and run next menu to set html file name
-            out_txt(output_file=custom_name)
-        elif choice == '2':
-            out_HTML(html_file=custom_name, pathway_table=False)  # generates only the genes table
-            out_txt(output_file=custom_name)
-        elif choice == '3':
-            out_HTML(html_file = custom_name, gene_table = False)  # generates only the pathways table
-            out_txt(output_file=custom_name)
+        if choice in ['1', '2', '3', '4']:
+            print("\nCreating table\n")  # status update so user knows that script is processing
+            write_tables(_table_types[int(choice) - 1], custom_name)  # generates the html and txt tables chosen
         else:
             print("Not a valid choice")
-            self.menu_table_type()
+            self.menu_table_type(custom_name)
 
 ############ if script is run then do this ############
 if __name__ == "__main__":
-    ui = UI()
-    ui.menu_data()
\ No newline at end of file
+    sys.modules.setdefault("GAEV", sys.modules[__name__])  # modules importing GAEV (ex. Color_Pathways) share this one
+    if len(sys.argv) > 1:  # steps given as arguments are run without the menus, see main()
+        main()
+    else:
+        ui = UI()
+        ui.menu_data()
\ No newline at end of file
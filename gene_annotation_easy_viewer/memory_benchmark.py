@@ -0,0 +1,79 @@
+############ Memory Benchmark ############
+# reports how many bytes every gene of a data file takes once it is loaded into memory by GAEV, before and after genes
+# and pathways were given compact records
+# usage: python memory_benchmark.py data_file [data_file ...]
+# data files are only read, never changed; version 1 data files are measured as they are
+import os  # path manipulation
+import sys  # reads the data files to measure from the command line
+import gc  # collects garbage before every measurement so earlier loads do not count
+import pickle  # recreates the legacy records the way they were read from version 1 data files
+import tracemalloc  # measures the memory allocated while loading the data file
+import GAEV
+
+
+class Legacy_Gene:  # gene record of older versions of GAEV: a per object __dict__ and its own copy of every string
+    def __init__(self, state):
+        self.__dict__.update(state)
+
+
+class Legacy_Pathway_MAP:  # pathway record of older versions of GAEV, with genes_invol as a list of k codes
+    def __init__(self, state):
+        self.__dict__.update(state)
+
+
+def measure(data_file):  # loads every gene of data_file into memory and returns (gene count, bytes, peak bytes)
+    GAEV.set_data_file(data_file)
+    gc.collect()
+    tracemalloc.start()
+    GAEV.load_data(lazy=False)  # keeps every gene in memory, which is what is being measured
+    genes = list(GAEV._gene_list)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del genes
+    return len(GAEV._gene_list), current, peak
+
+
+def measure_legacy(data_file):  # measures the same genes and pathways in the layout of older versions of GAEV
+    # every record of a version 1 data file was pickled on its own, so no string was shared between two records;
+    # unpickling each record separately rebuilds exactly that. Returns (gene count, bytes, peak bytes)
+    GAEV.set_data_file(data_file)
+    GAEV.load_data(lazy=False)
+    pathway_index = GAEV._pathway_index
+    records = [pickle.dumps({"gene_num": gene.gene_num, "k_code": gene.k_code, "name": gene.name,
+                             "definition": gene.definition, "log2foldchange": gene.log2foldchange,
+                             "link_path": [m_code + " " + pathway_index[m_code].name for m_code in gene.link_path]})
+               for gene in GAEV._gene_list]
+    pathway_records = [pickle.dumps({"map_code": pathway.map_code, "name": pathway.name,
+                                     "genes_invol": list(pathway.genes_invol), "url": pathway.url})
+                       for pathway in pathway_index.values()]
+    count = len(records)
+    GAEV._gene_list = GAEV.Gene_View([])  # releases the compact records loaded above, which must not be measured
+    del GAEV._pathway_list[:]
+    GAEV._pathway_index = {}
+    gc.collect()
+    tracemalloc.start()
+    genes = [Legacy_Gene(pickle.loads(record)) for record in records]
+    pathways = [Legacy_Pathway_MAP(pickle.loads(record)) for record in pathway_records]
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del genes, pathways
+    return count, current, peak
+
+
+def report(label, count, current, peak):
+    print("  " + label + ": " + str(current) + " bytes in memory (" + str(current // max(count, 1)) +
+          " bytes per gene), peak " + str(peak) + " bytes")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit("usage: python memory_benchmark.py data_file [data_file ...]")
+    for data_file in sys.argv[1:]:
+        count, legacy_current, legacy_peak = measure_legacy(data_file)
+        count, current, peak = measure(data_file)
+        print(os.path.basename(data_file) + ": " + str(count) + " genes")
+        report("before (dict-backed records)", count, legacy_current, legacy_peak)
+        report("after (compact records)", count, current, peak)
+        print("  " + str(round(legacy_current / max(current, 1), 1)) + " times less memory")